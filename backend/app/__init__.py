@@ -1,13 +1,14 @@
 from flask import Flask
 from flask_cors import CORS
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch, Elasticsearch
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
-# Global Elasticsearch client
+# Global Elasticsearch clients
 es_client = None
+async_es_client = None  # only used on the services.async_runtime loop
 
 def get_es_client():
     """Get Elasticsearch client singleton."""
@@ -17,6 +18,14 @@ def get_es_client():
         es_client = Elasticsearch(es_host)
     return es_client
 
+def get_async_es_client():
+    """Get AsyncElasticsearch client singleton for the async search pipeline."""
+    global async_es_client
+    if async_es_client is None:
+        es_host = os.getenv("ELASTICSEARCH_HOST", "http://localhost:9200")
+        async_es_client = AsyncElasticsearch(es_host)
+    return async_es_client
+
 def create_app():
     app = Flask(__name__)
 
@@ -57,8 +66,10 @@ def create_app():
     # Register routes
     from app.routes.health import health_bp
     from app.routes.search import search_bp
+    from app.routes.export import export_bp
 
     app.register_blueprint(health_bp, url_prefix='/api')
     app.register_blueprint(search_bp, url_prefix='/api')
+    app.register_blueprint(export_bp, url_prefix='/api')
 
     return app
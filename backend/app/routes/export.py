@@ -0,0 +1,165 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from app import get_es_client
+from app.routes.search import INDEX_NAME, format_result
+from services.nlp_service import ARRAY_KEYS, extract_entities
+from services.pagination import PIT_KEEP_ALIVE, build_cursor_body
+from services.query_builder import build_query
+import csv
+import io
+import json
+
+export_bp = Blueprint('export', __name__)
+
+EXPORT_PAGE_SIZE = 1000
+
+# Only the fields format_result reads are fetched
+EXPORT_SOURCE_FIELDS = [
+    "nct_id",
+    "brief_title",
+    "overall_status",
+    "phase",
+    "conditions.name",
+    "sponsors.name",
+    "sponsors.lead_or_collaborator",
+    "enrollment",
+    "facilities.city",
+    "facilities.state",
+    "facilities.country",
+    "start_date",
+]
+
+CSV_COLUMNS = [
+    "nct_id", "brief_title", "overall_status", "phase", "conditions", "sponsor",
+    "enrollment", "locations", "countries", "start_date", "score",
+]
+
+
+def iter_hits(es, entities):
+    """
+    Every hit for entities, read page by page from a point-in-time with
+    search_after. Only one page is held in memory at a time.
+
+    close() releases the point-in-time if the stream stops early.
+    """
+    pit_id = es.open_point_in_time(index=INDEX_NAME, keep_alive=PIT_KEEP_ALIVE)["id"]
+    try:
+        search_after = None
+        while True:
+            body = build_cursor_body(build_query(entities), pit_id, search_after)
+            body["size"] = EXPORT_PAGE_SIZE  # above the API's MAX_PAGE_SIZE on purpose
+            body.pop("highlight", None)
+            body["_source"] = EXPORT_SOURCE_FIELDS
+            body["track_total_hits"] = False
+
+            response = es.search(body=body)
+            pit_id = response.get("pit_id", pit_id)
+            hits = response["hits"]["hits"]
+            yield from hits
+
+            if len(hits) < EXPORT_PAGE_SIZE:
+                break
+            search_after = hits[-1]["sort"]
+    finally:
+        try:
+            es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            print(f"Closing point-in-time failed: {e}")
+
+
+def has_filters(entities):
+    """True if entities narrow the search; otherwise the query matches every trial."""
+    if any(entities.get(key) for key in ARRAY_KEYS):
+        return True
+    date = entities.get("date")
+    return isinstance(date, dict) and bool(date.get("start") or date.get("end"))
+
+
+def export_row(hit):
+    row = format_result(hit)
+    row.pop("highlights", None)
+    return row
+
+
+def ndjson_lines(hits):
+    """One JSON object per hit; a failure mid-stream ends with an error object."""
+    try:
+        for hit in hits:
+            yield json.dumps(export_row(hit)) + "\n"
+    except Exception as e:
+        print(f"Export failed mid-stream: {e}")
+        yield json.dumps({"success": False, "error": str(e)}) + "\n"
+
+
+def csv_lines(hits):
+    """A header and one row per hit; a failure mid-stream ends with an ERROR row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+    try:
+        for hit in hits:
+            row = export_row(hit)
+            writer.writerow([
+                "; ".join(str(v) for v in row[col]) if isinstance(row[col], list) else row[col]
+                for col in CSV_COLUMNS
+            ])
+            yield flush()
+    except Exception as e:
+        print(f"Export failed mid-stream: {e}")
+        writer.writerow(["ERROR", str(e)])
+        yield flush()
+
+
+@export_bp.route('/export/<path:query>', methods=['GET'])
+def export(query):
+    """
+    Stream every trial matching a natural language query.
+
+    GET /api/export/<natural language query>?format=ndjson|csv
+
+    Entities are extracted once; rows are flattened like /api/search results.
+    If Elasticsearch fails after the first bytes are sent, the stream ends with
+    an error record: {"success": false, "error": ...} for ndjson, a row
+    starting with ERROR for csv.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"success": False, "error": "format must be ndjson or csv"}), 400
+
+    nlp_result = extract_entities(query)
+    if not nlp_result.get("success"):
+        return jsonify({
+            "success": False,
+            "error": nlp_result.get("interpretation", ""),
+            "query": query
+        }), 400
+    if not has_filters(nlp_result["entities"]):
+        # query_type alone builds a match-everything query: no whole-index dumps
+        return jsonify({
+            "success": False,
+            "error": "Query has no searchable filters; refusing to export every trial",
+            "query": query
+        }), 400
+
+    hits = iter_hits(get_es_client(), nlp_result["entities"])
+    if export_format == "csv":
+        lines, mimetype = csv_lines(hits), "text/csv"
+    else:
+        lines, mimetype = ndjson_lines(hits), "application/x-ndjson"
+
+    response = Response(
+        stream_with_context(lines),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=trials.{export_format}"}
+    )
+    # Release the point-in-time as soon as the response ends, even on a
+    # client disconnect, instead of whenever the generator is collected
+    response.call_on_close(hits.close)
+    return response
@@ -27,12 +27,34 @@ def health_check():
         }
     }), 200
 
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Report cache hit/miss and request coalescing counters."""
+    from app.routes.search import get_coalescing_stats, get_result_cache_stats
+    from services.embedding_service import get_query_cache_stats
+    from services.mesh_service import get_synonym_cache_stats
+    from services.nlp_service import get_extraction_cache_stats
+    from services.query_builder import get_template_cache_stats
+    from services.rule_extractor import get_rule_extractor_stats
+
+    return jsonify({
+        "coalescing": get_coalescing_stats(),
+        "llm_extraction_cache": get_extraction_cache_stats(),
+        "rule_extractor": get_rule_extractor_stats(),
+        "search_result_cache": get_result_cache_stats(),
+        "query_embedding_cache": get_query_cache_stats(),
+        "query_template_cache": get_template_cache_stats(),
+        "synonym_cache": get_synonym_cache_stats()
+    }), 200
+
 @health_bp.route('/', methods=['GET'])
 def index():
     return jsonify({
         "message": "Clinical Trials Search API",
         "endpoints": {
             "health": "/api/health",
-            "search": "/api/search/<query>"
+            "metrics": "/api/metrics",
+            "search": "/api/search/<query>",
+            "export": "/api/export/<query>?format=ndjson|csv"
         }
     }), 200
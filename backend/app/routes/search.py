@@ -1,15 +1,105 @@
 
 
 from flask import Blueprint, jsonify, request
-from app import get_es_client
-from services.nlp_service import extract_entities
-from services.query_builder import build_query
+from elasticsearch import NotFoundError
+from app import get_async_es_client, get_es_client
+from services import async_runtime
+from services.cache import LRUCache
+from services.nlp_service import extract_entities_async, normalize_query
+from services.pagination import (
+    CursorError, build_cursor_body, close_pit, decode_cursor, next_cursor, open_pit
+)
+from services.query_builder import (
+    FACETS, agg_counts, build_aggregation_query, build_facet_aggs, build_query,
+    build_query_json, build_summary_aggs
+)
+from services.singleflight import SingleFlight
+import asyncio
 import math
+import os
+import time
 
 search_bp = Blueprint('search', __name__)
 
 INDEX_NAME = "clinical_trials"
 
+# Result cache: formatted pages keyed by (query body, index generation)
+RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = int(os.getenv("SEARCH_RESULT_CACHE_TTL", "300"))  # seconds
+GENERATION_CHECK_INTERVAL = int(os.getenv("SEARCH_GENERATION_CHECK_INTERVAL", "10"))  # seconds
+
+# Concurrent identical requests share one extraction / one ES round-trip
+_extraction_flight = SingleFlight("extract_entities")
+_search_flight = SingleFlight("es_search")
+
+
+_result_cache = LRUCache(RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+_generation = {"value": None, "checked_at": 0.0}
+
+
+async def get_index_generation(es):
+    """
+    Marker that changes whenever the index is rebuilt: the index UUID (new
+    on every delete/create) plus the generation ingest.py writes to the
+    mapping _meta. Re-read at most every GENERATION_CHECK_INTERVAL seconds.
+    None if it can't be read, in which case results aren't cached.
+    """
+    now = time.monotonic()
+    if _generation["value"] is not None and now - _generation["checked_at"] < GENERATION_CHECK_INTERVAL:
+        return _generation["value"]
+
+    try:
+        response = await es.indices.get(index=INDEX_NAME)
+        index = next(iter(response.values()))
+        uuid = index["settings"]["index"]["uuid"]
+        marker = index["mappings"].get("_meta", {}).get("generation", "")
+        generation = f"{uuid}:{marker}"
+    except Exception as e:
+        print(f"Reading index generation failed: {e}")
+        generation = None
+
+    if generation != _generation["value"] and _generation["value"] is not None:
+        _result_cache.clear()  # entries for the old index can never hit again
+    _generation["value"] = generation
+    _generation["checked_at"] = now
+    return generation
+
+
+def get_result_cache_stats():
+    """Hit/miss counters for cached search pages."""
+    return {**_result_cache.stats(), "index_generation": _generation["value"]}
+
+
+async def _search_page(es, es_body, facet_aggs):
+    response = await es.search(index=INDEX_NAME, body=es_body)
+    return format_page(response, facet_aggs)
+
+
+async def _cached_search(es, es_body, facet_aggs):
+    """
+    The formatted page for es_body. Cached pages are shared between
+    requests, so they must not be modified.
+    """
+    generation = await get_index_generation(es)
+    if generation is None:
+        return await _search_flight.do_async(es_body, _search_page, es, es_body, facet_aggs)
+
+    key = (es_body, generation)
+    page = _result_cache.get(key)
+    if page is None:
+        # The body doubles as the coalescing key; it already encodes the facets
+        page = await _search_flight.do_async(es_body, _search_page, es, es_body, facet_aggs)
+        _result_cache.set(key, page)
+    return page
+
+
+def get_coalescing_stats():
+    """How many in-flight calls were shared instead of executed."""
+    return {
+        "extract_entities": _extraction_flight.stats(),
+        "es_search": _search_flight.stats(),
+    }
+
 
 def format_result(hit):
     """Transform a single ES hit into a clean API response object."""
@@ -62,38 +152,111 @@ def format_result(hit):
     }
 
 
+def format_page(response, facet_aggs=None):
+    """Total, formatted results and counts for facet_aggs from an ES search response."""
+    aggregations = response.get("aggregations", {})
+    return {
+        "total": response.get("hits", {}).get("total", {}).get("value", 0),
+        "results": [format_result(hit) for hit in response.get("hits", {}).get("hits", [])],
+        "facets": {
+            name: [{"value": value, "count": count} for value, count in agg_counts(aggregations, name)]
+            for name in facet_aggs or {}
+        },
+    }
+
+
+async def run_search(query, page, size, cursor=None, start_cursor=False, facet_aggs=None):
+    """
+    Extraction and ES execution for one search; runs on the async_runtime loop.
+    With a decoded cursor (or start_cursor=True for page 1) the page is read
+    from a point-in-time with search_after instead of from/size. facet_aggs
+    are computed in the same request.
+
+    Returns:
+        (nlp_result, formatted page, next_cursor); see format_page
+    """
+    # Step 1: Extract entities using NLP service
+    nlp_result = await _extraction_flight.do_async(
+        normalize_query(query), extract_entities_async, query
+    )
+    entities = nlp_result.get("entities", {})
+    es = get_async_es_client()
+
+    if cursor is None and not start_cursor:
+        # Step 2: Build Elasticsearch query (serialized once per entities, then cached).
+        # A template miss may resolve synonyms/descendants, so it runs off the loop.
+        es_body = await asyncio.to_thread(
+            build_query_json, entities, page=page, size=size, aggs=facet_aggs
+        )
+
+        # Steps 3-4: Execute search and format it, or reuse the page for identical entities/page/size
+        return nlp_result, await _cached_search(es, es_body, facet_aggs), None
+
+    # Steps 2-3, cursor mode: PIT pages are per client, so they aren't coalesced
+    pit_id = cursor["pit"] if cursor else await open_pit(es, INDEX_NAME)
+    es_query = await asyncio.to_thread(build_query, entities, page=1, size=size)
+    body = build_cursor_body(es_query, pit_id, cursor["after"] if cursor else None)
+    if facet_aggs:
+        body["aggs"] = facet_aggs
+    response = await es.search(body=body)
+
+    cursor_token = next_cursor(response, page, size, query)
+    if cursor_token is None:
+        await close_pit(es, response.get("pit_id", pit_id))
+    return nlp_result, format_page(response, facet_aggs), cursor_token
+
+
 @search_bp.route('/search/<path:query>', methods=['GET'])
-def search(query):
+async def search(query):
     """
     Main search endpoint.
 
     GET /api/search/<natural language query>?page=1&size=10
+
+    Deep paging: ?paginate=cursor&size=N returns page 1 with a next_cursor;
+    pass it back as ?cursor=<token> for each following page.
+
+    Facet counts: ?facets=status,phase (or ?facets=all) adds per-trial counts
+    over all matches for the named facets; see FACETS in query_builder.
     """
     page = request.args.get('page', 1, type=int)
     size = request.args.get('size', 10, type=int)
     page = max(1, page)
     size = min(max(1, size), 100)
 
+    cursor = None
+    cursor_token = request.args.get('cursor')
+    start_cursor = request.args.get('paginate') == 'cursor'
+    try:
+        if cursor_token:
+            cursor = decode_cursor(cursor_token, query)
+            page, size = cursor["page"], cursor["size"]
+        elif start_cursor:
+            page = 1
+    except CursorError as e:
+        return _error_response(query, page, size, str(e), 400)
+
+    facets_param = request.args.get('facets', '')
+    if facets_param == 'all':
+        facet_names = list(FACETS)
+    else:
+        facet_names = [name.strip() for name in facets_param.split(',') if name.strip()]
     try:
-        # Step 1: Extract entities using NLP service
-        nlp_result = extract_entities(query)
+        facet_aggs = build_facet_aggs(facet_names) if facet_names else None
+    except ValueError as e:
+        return _error_response(query, page, size, str(e), 400)
+
+    try:
+        # Steps 1-4 share one long-lived event loop across all requests
+        nlp_result, page_result, next_cursor_token = await async_runtime.run(
+            run_search(query, page, size, cursor, start_cursor, facet_aggs)
+        )
         entities = nlp_result.get("entities", {})
         interpretation = nlp_result.get("interpretation", "")
 
-        # Step 2: Build Elasticsearch query
-        es_query = build_query(entities, page=page, size=size)
-
-        # Step 3: Execute search
-        es = get_es_client()
-        response = es.search(index=INDEX_NAME, body=es_query)
-
-        # Step 4: Format results
-        hits = response.get("hits", {})
-        total = hits.get("total", {}).get("value", 0)
+        total = page_result["total"]
         total_pages = math.ceil(total / size) if total > 0 else 0
 
-        results = [format_result(hit) for hit in hits.get("hits", [])]
-
         return jsonify({
             "success": True,
             "query": query,
@@ -103,23 +266,62 @@ def search(query):
             "page": page,
             "size": size,
             "total_pages": total_pages,
-            "results": results
+            "results": page_result["results"],
+            "facets": page_result["facets"],
+            "next_cursor": next_cursor_token
         }), 200
 
+    except NotFoundError as e:
+        if cursor is not None:
+            # The point-in-time behind the cursor expired
+            return _error_response(query, page, size, "Cursor expired, restart the search", 410)
+        return _error_response(query, page, size, str(e), 500)
     except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": str(e),
-            "query": query,
-            "interpretation": "",
-            "entities": {},
-            "total": 0,
-            "page": page,
-            "size": size,
-            "total_pages": 0,
-            "results": []
-        }), 500
+        return _error_response(query, page, size, str(e), 500)
+
+
+def _error_response(query, page, size, error, status):
+    return jsonify({
+        "success": False,
+        "error": error,
+        "query": query,
+        "interpretation": "",
+        "entities": {},
+        "total": 0,
+        "page": page,
+        "size": size,
+        "total_pages": 0,
+        "results": [],
+        "facets": {},
+        "next_cursor": None
+    }), status
     
+def fetch_question_stats(entities):
+    """
+    Exact total and status/phase/sponsor/country counts over every trial
+    matching entities, in one size-0 aggregation request.
+
+    Returns:
+        (total, status_counts, phase_counts, top_sponsors, top_countries),
+        or None if Elasticsearch is unavailable
+    """
+    try:
+        body = build_aggregation_query(entities, build_summary_aggs())
+        response = get_es_client().search(index=INDEX_NAME, body=body)
+    except Exception as e:
+        print(f"Aggregation stats failed, using posted results: {e}")
+        return None
+
+    aggregations = response.get("aggregations", {})
+    return (
+        response["hits"]["total"]["value"],
+        dict(agg_counts(aggregations, "status")),
+        dict(agg_counts(aggregations, "phase")),
+        agg_counts(aggregations, "sponsor")[:5],
+        agg_counts(aggregations, "country")[:5],
+    )
+
+
 @search_bp.route('/summarize', methods=['POST'])
 def summarize():
     data = request.get_json()
@@ -169,6 +371,14 @@ def summarize():
 
     query_type = entities.get("query_type", "search")
 
+    # Questions are answered from counts over all matches, not the posted page
+    stats_scope = "from the results shown"
+    if query_type == "question" and entities:
+        stats = fetch_question_stats(entities)
+        if stats:
+            total, status_counts, phase_counts, top_sponsors, top_countries = stats
+            stats_scope = f"exact, over all {total} matching trials"
+
     if query_type == "question":
         prompt = f"""You are a clinical trials research assistant. The user asked a QUESTION about clinical trials data. Answer it directly and specifically.
 
@@ -176,6 +386,7 @@ User's question: "{query}"
 Entities extracted: {entities}
 Total matching trials: {total}
 
+Statistics ({stats_scope}):
 Status breakdown: {status_counts}
 Phase breakdown: {phase_counts}
 Top sponsors: {top_sponsors}
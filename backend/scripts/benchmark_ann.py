@@ -0,0 +1,91 @@
+"""
+Recall-vs-latency benchmark of the IVF index against exact brute-force search.
+
+Uses the conditions matrix from data/embeddings_cache/ when it exists,
+otherwise a synthetic clustered matrix of SYNTHETIC_TERMS vectors.
+Queries are held-out perturbed copies of random rows.
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.ann_index import IVFIndex
+from services.embedding_service import current_cache_dir
+
+# Configuration
+CATEGORY = "conditions"
+SYNTHETIC_TERMS = 100000
+SYNTHETIC_DIM = 256
+N_QUERIES = 200
+TOP_K = 5
+N_PROBES = [1, 2, 4, 8, 16, 32]
+
+
+def normalize(matrix):
+    return matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+
+
+def load_matrix(synthetic_terms=SYNTHETIC_TERMS, synthetic_dim=SYNTHETIC_DIM):
+    """The cached CATEGORY matrix, or a synthetic clustered one if there is no cache."""
+    cache_dir = current_cache_dir()
+    path = os.path.join(cache_dir, f"{CATEGORY}.npy") if cache_dir else ""
+    if os.path.exists(path):
+        print(f"Using {path}")
+        return np.asarray(np.load(path), dtype=np.float32)
+
+    print(f"No cache found, using {synthetic_terms} synthetic {synthetic_dim}-dim vectors")
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(synthetic_terms // 100, synthetic_dim))
+    rows = centers[rng.integers(0, len(centers), synthetic_terms)]
+    rows += rng.normal(scale=1.5, size=rows.shape)
+    return normalize(rows).astype(np.float32)
+
+
+def held_out_queries(matrix, n_queries=N_QUERIES):
+    """Perturbed copies of random rows, normalized like real queries."""
+    rng = np.random.default_rng(1)
+    query_rows = matrix[rng.integers(0, len(matrix), n_queries)]
+    return normalize(query_rows + rng.normal(scale=0.05, size=query_rows.shape)).astype(np.float32)
+
+
+def exact_top_k(matrix, query, k):
+    scores = matrix @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def main():
+    matrix = load_matrix()
+    queries = held_out_queries(matrix)
+    k = min(TOP_K, len(matrix))
+
+    start = time.perf_counter()
+    exact = [set(exact_top_k(matrix, q, k)) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / N_QUERIES
+    print(f"Exact search: {exact_ms:.3f} ms/query over {len(matrix)} terms")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(matrix)
+    print(f"Built IVF index with {index.n_lists} lists in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'n_probe':>8} {'recall@' + str(k):>10} {'top-1':>8} {'ms/query':>10} {'speedup':>8}")
+    for n_probe in N_PROBES:
+        if n_probe > index.n_lists:
+            break
+        start = time.perf_counter()
+        approx = [index.search(matrix, q, k, n_probe)[0] for q in queries]
+        ann_ms = (time.perf_counter() - start) * 1000 / N_QUERIES
+
+        recall = np.mean([len(e & set(a)) / k for e, a in zip(exact, approx)])
+        top1 = np.mean([
+            len(a) > 0 and a[0] == exact_top_k(matrix, q, 1)[0]
+            for q, a in zip(queries, approx)
+        ])
+        print(f"{n_probe:>8} {recall:>10.3f} {top1:>8.3f} {ann_ms:>10.3f} {exact_ms / ann_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Elasticsearch latency of each condition expansion strategy on the real index.
+
+Conditions are sampled from data/unique_terms.json and expanded with their
+MeSH synonyms (run build_mesh_cache.py first). Each strategy runs the same
+condition-only queries; latency is ES "took" and client wall time, and
+result overlap is measured against the default "fuzzy" strategy.
+
+The lighter strategies were added without running this script: nothing
+about their latency or recall has been measured yet. Run it against the
+real index before changing CONDITION_EXPANSION from "fuzzy".
+"""
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from elasticsearch import Elasticsearch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.mesh_service import get_synonyms
+from services.query_builder import CONDITION_EXPANSION_STRATEGIES, build_condition_query
+
+# Configuration
+ES_HOST = os.getenv("ELASTICSEARCH_HOST", "http://localhost:9200")
+INDEX_NAME = "clinical_trials"
+TERMS_FILE = os.path.join(os.path.dirname(__file__), "..", "data", "unique_terms.json")
+N_CONDITIONS = 100
+ROUNDS = 5
+TOP_K = 10
+
+
+def sample_conditions():
+    """Conditions with more than one MeSH synonym, where the strategies differ."""
+    with open(TERMS_FILE, "r") as f:
+        conditions = json.load(f)["conditions"]
+
+    random.Random(0).shuffle(conditions)
+    sample = []
+    for condition in conditions:
+        synonyms = get_synonyms(condition)
+        if len(synonyms) > 1:
+            sample.append((condition, synonyms))
+        if len(sample) == N_CONDITIONS:
+            break
+    return sample
+
+
+def run(es, body):
+    start = time.perf_counter()
+    # request_cache=False so repeated rounds measure query execution
+    response = es.search(index=INDEX_NAME, body=body, request_cache=False)
+    wall_ms = (time.perf_counter() - start) * 1000
+    ids = [hit["_id"] for hit in response["hits"]["hits"]]
+    return response["took"], wall_ms, response["hits"]["total"]["value"], ids
+
+
+def main():
+    es = Elasticsearch(ES_HOST)
+    if not es.ping():
+        print(f"Could not connect to Elasticsearch at {ES_HOST}")
+        sys.exit(1)
+
+    sample = sample_conditions()
+    avg_synonyms = np.mean([len(s) for _, s in sample])
+    print(f"{len(sample)} conditions, {avg_synonyms:.1f} synonyms on average, {ROUNDS} rounds")
+
+    bodies = {
+        strategy: [
+            {
+                "query": build_condition_query(condition, synonyms, descendant_depth=0, expansion=strategy),
+                "size": TOP_K,
+                "track_total_hits": True,
+            }
+            for condition, synonyms in sample
+        ]
+        for strategy in CONDITION_EXPANSION_STRATEGIES
+    }
+
+    # Warm up caches and JIT-compiled query paths once per strategy
+    for strategy in CONDITION_EXPANSION_STRATEGIES:
+        for body in bodies[strategy]:
+            run(es, body)
+
+    results = {}
+    for strategy in CONDITION_EXPANSION_STRATEGIES:
+        took, wall = [], []
+        for _ in range(ROUNDS):
+            for i, body in enumerate(bodies[strategy]):
+                t, w, total, ids = run(es, body)
+                took.append(t)
+                wall.append(w)
+                results.setdefault(strategy, {})[i] = (total, ids)
+        body_bytes = np.mean([len(json.dumps(b)) for b in bodies[strategy]])
+        print(f"{strategy:>14}: took p50 {np.percentile(took, 50):.1f} ms, p95 {np.percentile(took, 95):.1f} ms; "
+              f"wall p50 {np.percentile(wall, 50):.1f} ms; body {body_bytes:.0f} bytes")
+
+    baseline = results["fuzzy"]
+    for strategy in CONDITION_EXPANSION_STRATEGIES:
+        if strategy == "fuzzy":
+            continue
+        hits_ratio = np.mean([
+            results[strategy][i][0] / baseline[i][0] if baseline[i][0] else 1.0 for i in baseline
+        ])
+        overlap = np.mean([
+            len(set(results[strategy][i][1]) & set(baseline[i][1])) / max(len(baseline[i][1]), 1)
+            for i in baseline
+        ])
+        print(f"{strategy:>14} vs fuzzy: total hits x{hits_ratio:.2f}, top-{TOP_K} overlap {overlap:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Memory and accuracy of quantized first-pass search with exact re-ranking.
+
+Uses the conditions matrix from data/embeddings_cache/ when it exists,
+otherwise a synthetic clustered matrix. Held-out queries are perturbed
+copies of random rows; accuracy is measured against exact float32 search.
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmark_ann import held_out_queries, load_matrix
+from services.embedding_service import RERANK_CANDIDATES, top_k_indices as top_k
+from services.quantization import QUANTIZATION_MODES, quantize_matrix, approximate_scores, rerank, nbytes
+
+# Configuration
+SYNTHETIC_TERMS = 20000
+SYNTHETIC_DIM = 1536
+N_QUERIES = 200
+TOP_K = 5
+
+
+def main():
+    matrix = load_matrix(SYNTHETIC_TERMS, SYNTHETIC_DIM)
+    queries = held_out_queries(matrix, N_QUERIES)
+    k = min(TOP_K, len(matrix))
+
+    start = time.perf_counter()
+    exact = [top_k(matrix @ q, k) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / N_QUERIES
+    print(f"float32: {matrix.nbytes / 1e6:.1f} MB, {exact_ms:.3f} ms/query")
+
+    for mode in QUANTIZATION_MODES:
+        quantized, scales = quantize_matrix(matrix, mode)
+        size = nbytes(quantized, scales)
+
+        start = time.perf_counter()
+        first_pass = []
+        reranked = []
+        for q in queries:
+            approx = approximate_scores(quantized, scales, q)
+            first_pass.append(top_k(approx, k))
+            candidates = top_k(approx, max(k, RERANK_CANDIDATES))
+            reranked.append(rerank(matrix, q, candidates, k)[0])
+        ms = (time.perf_counter() - start) * 1000 / N_QUERIES
+
+        def recall(results):
+            return np.mean([len(set(e) & set(r)) / k for e, r in zip(exact, results)])
+
+        def top1(results):
+            return np.mean([e[0] == r[0] for e, r in zip(exact, results)])
+
+        print(f"{mode}: {size / 1e6:.1f} MB ({matrix.nbytes / size:.1f}x smaller), {ms:.3f} ms/query")
+        print(f"  first pass only: recall@{k} {recall(first_pass):.3f}, top-1 {top1(first_pass):.3f}")
+        print(f"  re-ranked:       recall@{k} {recall(reranked):.3f}, top-1 {top1(reranked):.3f}")
+
+
+if __name__ == "__main__":
+    main()
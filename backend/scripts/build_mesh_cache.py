@@ -1,7 +1,11 @@
 import xml.etree.ElementTree as ET
 import json
+import mmap
 import os
+import sys
 import time
+from multiprocessing import Pool
+from xml.parsers import expat
 
 # Paths
 SCRIPT_DIR = os.path.dirname(__file__)
@@ -10,32 +14,28 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 XML_FILE = os.path.join(DATA_DIR, "desc2026.xml")
 SYNONYMS_OUTPUT = os.path.join(DATA_DIR, "mesh_synonyms.json")
 TERMS_OUTPUT = os.path.join(DATA_DIR, "mesh_terms_list.json")
+TREE_OUTPUT = os.path.join(DATA_DIR, "mesh_tree.json")
 
 MAX_SYNONYMS_PER_GROUP = 20
+RECORDS_PER_CHUNK = 2000
+RECORD_END_TAG = b"</DescriptorRecord>"
 
 
-def build_mesh_cache():
-    if not os.path.exists(XML_FILE):
-        print(f"ERROR: MeSH XML file not found: {XML_FILE}")
-        return
-
-    print(f"Parsing {XML_FILE} ...")
-    start = time.time()
+# --- Parsing ---
+# Each parser yields one (preferred_name, terms, tree_numbers) tuple per
+# DescriptorRecord, in document order. terms are the raw non-permuted term strings.
 
-    synonym_dict = {}
-    preferred_terms = []
-    descriptor_count = 0
-
-    for event, elem in ET.iterparse(XML_FILE, events=["end"]):
+def iter_records_elementtree(xml_path):
+    """Reference parser: ElementTree iterparse with XPath searches per record."""
+    for event, elem in ET.iterparse(xml_path, events=["end"]):
         if elem.tag != "DescriptorRecord":
             continue
 
-        descriptor_count += 1
-
         # Get preferred descriptor name
+        preferred_name = None
         descriptor_name_elem = elem.find(".//DescriptorName/String")
         if descriptor_name_elem is not None and descriptor_name_elem.text:
-            preferred_terms.append(descriptor_name_elem.text)
+            preferred_name = descriptor_name_elem.text
 
         # Collect all non-permuted terms across all concepts
         all_terms = []
@@ -46,37 +46,218 @@ def build_mesh_cache():
             if term_str is not None and term_str.text:
                 all_terms.append(term_str.text)
 
-        # Deduplicate while preserving order
-        all_terms = list(dict.fromkeys(all_terms))
-
-        # Cap at MAX_SYNONYMS_PER_GROUP
-        all_terms = all_terms[:MAX_SYNONYMS_PER_GROUP]
-
-        # Add bidirectional mappings (every synonym → full group)
-        for term in all_terms:
-            synonym_dict[term.lower()] = all_terms
+        # Tree numbers place the descriptor in the MeSH hierarchy
+        tree_numbers = [
+            tn.text for tn in elem.findall("TreeNumberList/TreeNumber") if tn.text
+        ]
 
         # Free memory
         elem.clear()
 
-        if descriptor_count % 10000 == 0:
-            print(f"  Processed {descriptor_count} descriptors...")
+        yield preferred_name, all_terms, tree_numbers
 
-    elapsed = time.time() - start
-    print(f"Parsed {descriptor_count} descriptors in {elapsed:.1f}s")
 
-    # Save synonym dictionary
-    with open(SYNONYMS_OUTPUT, "w") as f:
-        json.dump(synonym_dict, f)
-    size_mb = os.path.getsize(SYNONYMS_OUTPUT) / (1024 * 1024)
-    print(f"Saved {len(synonym_dict)} synonym mappings to mesh_synonyms.json ({size_mb:.1f} MB)")
+def parse_chunk(chunk_range):
+    """
+    Parse a byte range of whole DescriptorRecords with an event-driven expat
+    parser. Only the strings we keep are collected and no element tree is built.
+    """
+    xml_path, start, end = chunk_range
+    with open(xml_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    records = []
+    stack = []
+    name = None
+    name_seen = False
+    terms = []
+    tree_numbers = []
+    permuted = False
+    term_string_seen = False
+    collect = None  # "name", "term", "tree" or None
+    text = []
+
+    def start_element(tag, attrs):
+        nonlocal name, name_seen, terms, tree_numbers, permuted, term_string_seen, collect, text
+        if tag == "String":
+            # Same strings as .//DescriptorName/String (first only) and Term/String
+            parent = stack[-1]
+            if parent == "DescriptorName" and not name_seen:
+                collect, text = "name", []
+            elif parent == "Term" and not term_string_seen and not permuted:
+                collect, text = "term", []
+        elif tag == "Term":
+            permuted = attrs.get("IsPermutedTermYN") == "Y"
+            term_string_seen = False
+        elif tag == "TreeNumber" and stack[-1] == "TreeNumberList" and stack[-2] == "DescriptorRecord":
+            collect, text = "tree", []
+        elif tag == "DescriptorRecord":
+            name, name_seen, terms, tree_numbers = None, False, [], []
+        stack.append(tag)
+
+    def end_element(tag):
+        nonlocal name, name_seen, term_string_seen, collect
+        stack.pop()
+        if tag == "String":
+            parent = stack[-1]
+            if parent == "DescriptorName" and not name_seen:
+                name_seen = True
+                name = "".join(text) or None
+            elif parent == "Term":
+                if collect == "term" and text:
+                    terms.append("".join(text))
+                term_string_seen = True
+            collect = None
+        elif tag == "TreeNumber" and collect == "tree":
+            if text:
+                tree_numbers.append("".join(text))
+            collect = None
+        elif tag == "DescriptorRecord":
+            records.append((name, terms, tree_numbers))
+
+    def char_data(data):
+        if collect:
+            text.append(data)
+
+    parser = expat.ParserCreate("UTF-8")
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = char_data
+    parser.Parse(b"<Chunk>" + data + b"</Chunk>", True)
+    return records
+
+
+def chunk_ranges(xml_path, records_per_chunk=None):
+    """Split the file into byte ranges that each hold whole DescriptorRecords."""
+    records_per_chunk = records_per_chunk or RECORDS_PER_CHUNK
+    with open(xml_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = mm.find(b"<DescriptorRecord ")
+        first_plain = mm.find(b"<DescriptorRecord>")
+        if start == -1 or (first_plain != -1 and first_plain < start):
+            start = first_plain
+        if start == -1:
+            return
+
+        position = start
+        count = 0
+        while True:
+            end = mm.find(RECORD_END_TAG, position)
+            if end == -1:
+                break
+            position = end + len(RECORD_END_TAG)
+            count += 1
+            if count == records_per_chunk:
+                yield xml_path, start, position
+                start, count = position, 0
+        if count:
+            yield xml_path, start, position
+
+
+def iter_records_parallel(xml_path, workers=None):
+    """Parse chunks across a process pool, yielding records in document order."""
+    ranges = chunk_ranges(xml_path)
+    if workers == 1:
+        for chunk_range in ranges:
+            yield from parse_chunk(chunk_range)
+        return
+
+    with Pool(workers) as pool:
+        for records in pool.imap(parse_chunk, ranges):
+            yield from records
+
+
+# --- Output ---
+
+def write_mesh_cache(records, synonyms_path, terms_path, tree_path):
+    """
+    Stream records into mesh_synonyms.json and mesh_terms_list.json.
+    Only the key → group id mapping and the tree numbers are held in memory;
+    groups are written as they arrive. Output bytes match json.dump of the
+    equivalent objects.
+
+    mesh_tree.json holds every tree number sorted, with the group id of its
+    descriptor (group ids are descriptor indexes) and descriptor names.
+
+    Returns:
+        (descriptor_count, key_count)
+    """
+    key_groups = {}
+    tree_entries = []
+    descriptor_names = []
+    descriptor_count = 0
+    start = time.time()
+
+    with open(synonyms_path, "w") as synonyms_file, open(terms_path, "w") as terms_file:
+        synonyms_file.write('{"format": 2, "groups": [')
+        terms_file.write("[")
+        preferred_count = 0
+
+        for preferred_name, terms, tree_numbers in records:
+            descriptor_names.append(preferred_name)
+            tree_entries.extend((tn, descriptor_count) for tn in tree_numbers)
+            if preferred_name:
+                terms_file.write((", " if preferred_count else "") + json.dumps(preferred_name))
+                preferred_count += 1
+
+            # Deduplicate while preserving order, cap at MAX_SYNONYMS_PER_GROUP
+            all_terms = list(dict.fromkeys(terms))[:MAX_SYNONYMS_PER_GROUP]
+
+            # Add bidirectional mappings (every synonym → full group)
+            group_id = descriptor_count
+            synonyms_file.write((", " if group_id else "") + json.dumps(all_terms))
+            for term in all_terms:
+                key_groups[term.lower()] = group_id
+
+            descriptor_count += 1
+            if descriptor_count % 10000 == 0:
+                rate = descriptor_count / (time.time() - start)
+                print(f"  Processed {descriptor_count} descriptors ({rate:.0f} records/sec)...")
+
+        synonyms_file.write('], "keys": ')
+        json.dump(key_groups, synonyms_file)
+        synonyms_file.write("}")
+        terms_file.write("]")
+
+    # Sorted tree numbers make every subtree a contiguous range
+    tree_entries.sort()
+    with open(tree_path, "w") as f:
+        json.dump({
+            "descriptor_count": descriptor_count,
+            "tree_numbers": [tn for tn, _ in tree_entries],
+            "descriptor_ids": [d for _, d in tree_entries],
+            "names": descriptor_names,
+        }, f)
+
+    return descriptor_count, len(key_groups)
+
+
+def build_mesh_cache(xml_path=XML_FILE, synonyms_path=SYNONYMS_OUTPUT, terms_path=TERMS_OUTPUT,
+                     tree_path=TREE_OUTPUT, workers=None, reference=False):
+    if not os.path.exists(xml_path):
+        print(f"ERROR: MeSH XML file not found: {xml_path}")
+        return
+
+    print(f"Parsing {xml_path} ...")
+    start = time.time()
+
+    records = iter_records_elementtree(xml_path) if reference else iter_records_parallel(xml_path, workers)
+    descriptor_count, key_count = write_mesh_cache(records, synonyms_path, terms_path, tree_path)
+
+    elapsed = time.time() - start
+    print(f"Parsed {descriptor_count} descriptors in {elapsed:.1f}s "
+          f"({descriptor_count / max(elapsed, 1e-9):.0f} records/sec)")
 
-    # Save preferred terms list
-    with open(TERMS_OUTPUT, "w") as f:
-        json.dump(preferred_terms, f)
-    size_mb = os.path.getsize(TERMS_OUTPUT) / (1024 * 1024)
-    print(f"Saved {len(preferred_terms)} preferred terms to mesh_terms_list.json ({size_mb:.1f} MB)")
+    size_mb = os.path.getsize(synonyms_path) / (1024 * 1024)
+    print(f"Saved {key_count} synonym mappings in {descriptor_count} groups to "
+          f"{os.path.basename(synonyms_path)} ({size_mb:.1f} MB)")
+    size_mb = os.path.getsize(terms_path) / (1024 * 1024)
+    print(f"Saved preferred terms to {os.path.basename(terms_path)} ({size_mb:.1f} MB)")
+    size_mb = os.path.getsize(tree_path) / (1024 * 1024)
+    print(f"Saved tree number index to {os.path.basename(tree_path)} ({size_mb:.1f} MB)")
 
 
 if __name__ == "__main__":
-    build_mesh_cache()
\ No newline at end of file
+    # --reference uses the single-process ElementTree parser (for comparison)
+    build_mesh_cache(reference="--reference" in sys.argv[1:])
@@ -0,0 +1,84 @@
+"""
+Local fake of the OpenAI embeddings endpoint for testing batch embedding.
+
+Returns deterministic vectors derived from a hash of each input. Point the
+backend at it with:
+
+    OPENAI_BASE_URL=http://localhost:8089/v1 OPENAI_API_KEY=fake python scripts/...
+
+FAKE_LATENCY adds seconds of delay per request and FAKE_FAILURE_RATE makes
+that fraction of requests fail with HTTP 500, to exercise retries.
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# Configuration
+PORT = int(os.getenv("FAKE_EMBEDDINGS_PORT", "8089"))
+DIMENSION = 1536
+LATENCY = float(os.getenv("FAKE_LATENCY", "0.2"))
+FAILURE_RATE = float(os.getenv("FAKE_FAILURE_RATE", "0.0"))
+
+
+def fake_embedding(text):
+    """Deterministic unit vector for a string."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).normal(size=DIMENSION).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class EmbeddingsHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.path.endswith("/embeddings"):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(LATENCY)
+        if random.random() < FAILURE_RATE:
+            self.send_error(500, "Injected failure")
+            return
+
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        payload = json.dumps({
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("localhost", PORT), EmbeddingsHandler)
+    print(f"Fake embeddings endpoint on http://localhost:{PORT}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import json
 import os
 import sys
+import time
 from elasticsearch import Elasticsearch
 from elasticsearch.helpers import bulk
 
@@ -162,6 +163,16 @@ def get_index_mapping():
         }
     }
 
+def mark_index_generation(es):
+    """
+    Stamp the index mapping with a new generation marker. The search API
+    keys its result cache on it, so cached pages are dropped after a rebuild.
+    """
+    generation = str(time.time_ns())
+    es.indices.put_mapping(index=INDEX_NAME, meta={"generation": generation})
+    print(f"Index generation set to {generation}")
+
+
 def clean_value(value):
     """Convert 'NA' strings and empty strings to None."""
     if value == "NA" or value == "":
@@ -257,6 +268,9 @@ def main():
     count = es.count(index=INDEX_NAME)["count"]
     print(f"Verifying... Index contains {count} documents")
 
+    # Invalidate search results cached while the index was being rebuilt
+    mark_index_generation(es)
+
 
 if __name__ == "__main__":
     main()
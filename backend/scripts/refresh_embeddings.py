@@ -0,0 +1,16 @@
+"""
+Incrementally refresh the term embeddings cache after extract_terms.py.
+
+Only terms missing from the cache are embedded; terms no longer in
+unique_terms.json are dropped.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.embedding_service import init_embedding_service
+
+
+if __name__ == "__main__":
+    init_embedding_service(refresh=True)
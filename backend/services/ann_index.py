@@ -0,0 +1,111 @@
+"""
+Approximate nearest neighbour index over pre-normalized term embeddings.
+
+An inverted-file (IVF) index built with numpy only: rows are clustered with
+spherical k-means, and a query is scored against the rows of the few
+closest clusters instead of the whole matrix.
+"""
+import numpy as np
+
+# Configuration
+DEFAULT_N_PROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_SIZE = 50000
+ASSIGN_CHUNK_SIZE = 8192
+
+
+def _assign(matrix, centroids):
+    """Index of the closest centroid for every row, computed in chunks."""
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(matrix[start:start + ASSIGN_CHUNK_SIZE], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFIndex:
+    """Inverted lists of row ids grouped by their closest centroid."""
+
+    def __init__(self, centroids, offsets, ids):
+        self.centroids = centroids  # (n_lists, dim) float32, normalized
+        self.offsets = offsets      # (n_lists + 1,) start of each list in ids
+        self.ids = ids              # row ids ordered by list
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, n_lists=None, seed=0):
+        """Cluster the rows of a normalized matrix and build the inverted lists."""
+        n_rows = matrix.shape[0]
+        n_lists = n_lists or max(1, int(np.sqrt(n_rows)))
+        rng = np.random.default_rng(seed)
+
+        sample_ids = rng.choice(n_rows, size=min(n_rows, KMEANS_SAMPLE_SIZE), replace=False)
+        sample = np.asarray(matrix[np.sort(sample_ids)], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=n_lists) == 0
+            # Re-seed empty clusters with random sample rows
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assignments = _assign(matrix, centroids)
+        ids = np.argsort(assignments, kind="stable").astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=n_lists))
+
+        return cls(centroids.astype(np.float32), offsets, ids)
+
+    def candidates(self, query_vector, n_probe=DEFAULT_N_PROBE):
+        """Row ids in the n_probe lists closest to the query."""
+        n_probe = min(n_probe, self.n_lists)
+        centroid_scores = self.centroids @ query_vector
+        if n_probe < self.n_lists:
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probe = np.arange(self.n_lists)
+        return np.concatenate([
+            self.ids[self.offsets[i]:self.offsets[i + 1]] for i in probe
+        ])
+
+    def search(self, matrix, query_vector, k=1, n_probe=DEFAULT_N_PROBE):
+        """
+        Approximate top-k search.
+
+        Returns:
+            (row_ids, scores) arrays, best first
+        """
+        # Sorted ids keep reads from a memory-mapped matrix sequential
+        candidate_ids = np.sort(self.candidates(query_vector, n_probe))
+        if len(candidate_ids) == 0:
+            return candidate_ids, np.array([], dtype=np.float32)
+
+        scores = np.asarray(matrix[candidate_ids], dtype=np.float32) @ query_vector
+
+        k = min(k, len(candidate_ids))
+        if k < len(candidate_ids):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(candidate_ids))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidate_ids[top], scores[top]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, offsets=self.offsets, ids=self.ids)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["centroids"], data["offsets"], data["ids"])
@@ -0,0 +1,42 @@
+"""
+A long-lived event loop in a background thread for the async search pipeline.
+
+Flask runs every async view in a new event loop that is closed when the view
+returns, so loop-bound clients (AsyncOpenAI, AsyncElasticsearch) could not
+keep their connection pools between requests. Pipeline coroutines are
+scheduled on this shared loop instead: its clients live as long as the
+process, and one loop interleaves the I/O of every in-flight search.
+
+Because every search shares the loop, coroutines on it must not block:
+synchronous work that can wait on I/O or scan large structures (SQLite
+cache reads, MeSH lookups, query building) goes through asyncio.to_thread.
+"""
+import asyncio
+import threading
+
+# Global state
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """Start the pipeline loop on first use."""
+    global _loop
+
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-pipeline", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def submit(coro):
+    """Schedule coro on the pipeline loop; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+async def run(coro):
+    """Await coro on the pipeline loop from any other event loop."""
+    return await asyncio.wrap_future(submit(coro))
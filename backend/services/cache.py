@@ -0,0 +1,188 @@
+"""
+Small thread-safe caches shared by the services.
+
+- LRUCache: bounded in-memory cache with least-recently-used eviction and optional TTL
+- SQLiteCache: persistent key/value tier that survives restarts
+- TieredCache: memory tier in front of an optional persistent tier
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded in-memory cache with hit/miss counters. Entries expire after ttl seconds if set."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        """Whether key has a live entry; doesn't count as a hit or miss."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (entry[0] is None or entry[0] > time.monotonic())
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteCache:
+    """Persistent JSON-valued cache in a single SQLite table, opened on first use."""
+
+    def __init__(self, path, table="cache"):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = None  # importing a service must not create database files
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        """Open the database and create the table. Call with the lock held."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT value FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        encoded = json.dumps(value)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                (key, encoded),
+            )
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is None:
+                return 0
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class TieredCache:
+    """
+    In-memory LRU in front of an optional persistent tier. If the persistent
+    tier fails (e.g. its database can't be created) it is dropped and the
+    cache keeps working from memory.
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def _disk_call(self, method, *args):
+        disk = self.disk
+        if disk is None:
+            return _MISSING
+        try:
+            return getattr(disk, method)(*args)
+        except Exception as e:
+            print(f"Disk cache {getattr(disk, 'path', '')} unavailable: {e}")
+            self.disk = None
+            return _MISSING
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        value = self._disk_call("get", key, _MISSING)
+        if value is not _MISSING:
+            self.memory.set(key, value)
+            return value
+
+        return default
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self._disk_call("set", key, value)
+
+    def clear(self):
+        self.memory.clear()
+        self._disk_call("clear")
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
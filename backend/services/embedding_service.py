@@ -1,21 +1,71 @@
+import asyncio
+import fcntl
 import json
 import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
+from services.ann_index import IVFIndex
+from services.cache import LRUCache, SQLiteCache, TieredCache
+from services import quantization
 
 load_dotenv()
 
 #Configuration
 EMBEDDING_MODEL = "text-embedding-3-small"
 SIMILARITY_THRESHOLD = 0.70
+# Query-time requests fail fast instead of the client's 600 s default
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "10"))  # seconds
+EMBED_BATCH_TIMEOUT = float(os.getenv("EMBED_BATCH_TIMEOUT", "120"))  # seconds, offline batches
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 TERMS_FILE = os.path.join(BASE_DIR, "data", "unique_terms.json")
-CACHE_FILE = os.path.join(BASE_DIR, "data", "embeddings_cache.json")
+CACHE_FILE = os.path.join(BASE_DIR, "data", "embeddings_cache.json")  # legacy JSON format
+CACHE_DIR = os.path.join(BASE_DIR, "data", "embeddings_cache")
+CACHE_META_FILE = "meta.json"
+CACHE_POINTER_FILE = "CURRENT"  # name of the live version directory inside CACHE_DIR
+CACHE_LOCK_FILE = ".lock"
+STALE_STAGING_SECONDS = 24 * 3600  # staging directories older than this were abandoned
+# Stored as float32: NumPy has no fast float16 matrix product, so a float16
+# matrix would be upcast in full on every query
+CACHE_DTYPE = "float32"
+ANN_MIN_TERMS = int(os.getenv("ANN_MIN_TERMS", "20000"))  # below this, brute force is faster
+ANN_N_PROBE = int(os.getenv("ANN_N_PROBE", "8"))
+# First-pass scan over an int8/float16 copy, then exact re-ranking of the top candidates
+QUANTIZATION = os.getenv("EMBEDDINGS_QUANTIZATION", "")  # "", "int8" or "float16"
+RERANK_CANDIDATES = 32
+QUERY_BLOCK_SIZE = 256  # query rows scored per matrix-matrix product
+EMBED_BATCH_SIZE = 500  # OpenAI allows up to 2048 inputs per request
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_RETRY_BASE_DELAY = 1.0  # seconds, doubled on every retry
+CHECKPOINT_DIR = os.path.join(BASE_DIR, "data")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+# Persistent tier for query embeddings; set to "" to keep the cache in memory only
+QUERY_CACHE_DB = os.getenv(
+    "QUERY_EMBEDDING_CACHE_DB", os.path.join(BASE_DIR, "data", "query_embeddings.db")
+)
+
+
+def _build_query_cache():
+    """LRU cache for query-text embeddings, backed by SQLite when configured."""
+    disk = SQLiteCache(QUERY_CACHE_DB, table="query_embeddings") if QUERY_CACHE_DB else None
+    return TieredCache(LRUCache(QUERY_CACHE_SIZE), disk)
+
 
 #Global state
-client = OpenAI()
-_embeddings_cache = {}  # {"conditions": {"term": [vector]}, "interventions": {"term": [vector]}}
+client = OpenAI(timeout=EMBEDDING_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
+# only used on the services.async_runtime loop
+async_client = AsyncOpenAI(timeout=EMBEDDING_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
+_term_index = {}  # {"conditions": {"terms": ndarray, "matrix": ndarray, "ann"/"quantized": ...}, ...}
+_query_cache = _build_query_cache()  # {query_cache_key(text): [vector]}
 
 
 def load_unique_terms():
@@ -24,51 +74,354 @@ def load_unique_terms():
         return json.load(f)
 
 
-def get_embedding(text):
-    """Get embedding vector for a single text string."""
-    response = client.embeddings.create(
-        input=text,
-        model=EMBEDDING_MODEL
-    )
-    return response.data[0].embedding
+def query_cache_key(text):
+    """
+    Query embedding cache key: whitespace is collapsed, case is kept because
+    it changes the vector ("ALL" the leukemia vs "all"). Only the key is
+    normalized; the text is sent to the API as given.
+    """
+    return f"{EMBEDDING_MODEL}:" + re.sub(r"\s+", " ", text).strip()
 
 
-def compute_all_embeddings(terms):
+def get_embedding(text):
     """
-    Compute embeddings for a list of terms in batches.
-    OpenAI allows up to 2048 inputs per request for text-embedding-3-small.
+    Get embedding vector for a single text string.
+    Repeated queries are served from the query embedding cache.
     """
-    embeddings = {}
-    batch_size = 500
+    key = query_cache_key(text)
+
+    embedding = _query_cache.get(key)
+    if embedding is None:
+        response = client.embeddings.create(input=text, model=EMBEDDING_MODEL)
+        embedding = _remember_embedding(key, response)
+    return embedding
 
-    for i in range(0, len(terms), batch_size):
-        batch = terms[i:i + batch_size]
+
+def _remember_embedding(key, response):
+    """Cache and return the vector from a single-input embeddings response."""
+    embedding = response.data[0].embedding
+    _query_cache.set(key, embedding)
+    return embedding
+
+
+def get_embeddings(texts):
+    """
+    Embedding vectors for several texts, in input order. Cached texts come
+    from the query embedding cache; the rest are embedded together, up to
+    EMBED_BATCH_SIZE texts per request.
+    """
+    embeddings = [None] * len(texts)
+    pending = {}  # {cache key: (text, [positions])}
+    for i, text in enumerate(texts):
+        key = query_cache_key(text)
+        embedding = _query_cache.get(key)
+        if embedding is not None:
+            embeddings[i] = embedding
+        else:
+            pending.setdefault(key, (text, []))[1].append(i)
+
+    pending_keys = list(pending)
+    for start in range(0, len(pending_keys), EMBED_BATCH_SIZE):
+        batch = pending_keys[start:start + EMBED_BATCH_SIZE]
         response = client.embeddings.create(
-            input=batch,
+            input=[pending[key][0] for key in batch],
             model=EMBEDDING_MODEL
         )
-        for j, item in enumerate(response.data):
-            embeddings[batch[j]] = item.embedding
-        print(f"  Computed embeddings: {min(i + batch_size, len(terms))}/{len(terms)}")
+        for key, item in zip(batch, response.data):
+            _query_cache.set(key, item.embedding)
+            for i in pending[key][1]:
+                embeddings[i] = item.embedding
 
     return embeddings
 
 
-def save_embeddings_cache(cache):
-    """Save pre-computed embeddings to disk."""
-    with open(CACHE_FILE, "w") as f:
-        json.dump(cache, f)
-    print(f"Saved embeddings cache to {CACHE_FILE}")
+async def get_embedding_async(text):
+    """
+    get_embedding for the async pipeline; shares the query embedding cache.
+    Cache reads and writes can hit SQLite, so they run off the event loop.
+    """
+    key = query_cache_key(text)
 
+    embedding = await asyncio.to_thread(_query_cache.get, key)
+    if embedding is None:
+        response = await async_client.embeddings.create(input=text, model=EMBEDDING_MODEL)
+        embedding = await asyncio.to_thread(_remember_embedding, key, response)
+    return embedding
 
-def load_embeddings_cache():
-    """Load cached embeddings from disk if they exist."""
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r") as f:
-            return json.load(f)
+
+def get_query_cache_stats():
+    """Hit/miss counters for the query embedding cache."""
+    return _query_cache.stats()
+
+
+def embed_batch(batch):
+    """Embed one batch of terms, retrying with exponential backoff and jitter."""
+    batch_client = client.with_options(timeout=EMBED_BATCH_TIMEOUT)
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            response = batch_client.embeddings.create(
+                input=batch,
+                model=EMBEDDING_MODEL
+            )
+            return [item.embedding for item in response.data]
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = EMBED_RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random())
+            print(f"  Embedding batch failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def checkpoint_path(name):
+    """Path of the append-only checkpoint file for one embedding run."""
+    return os.path.join(CHECKPOINT_DIR, f"embeddings_checkpoint_{name}.jsonl")
+
+
+def load_checkpoint(path):
+    """Read completed batches from a checkpoint file. Unreadable lines are skipped."""
+    embeddings = {}
+    if not path or not os.path.exists(path):
+        return embeddings
+
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            embeddings.update(zip(record["terms"], record["embeddings"]))
+    return embeddings
+
+
+def truncate_torn_tail(path):
+    """
+    Cut a checkpoint back to its last complete line. A crash mid-write leaves
+    a fragment without a newline; appending after it would glue the next
+    batch onto the fragment and lose both.
+    """
+    if not path or not os.path.exists(path):
+        return
+
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position < size:
+            print(f"  Dropping {size - position} bytes of a torn checkpoint line")
+            f.truncate(position)
+
+
+def compute_all_embeddings(terms, checkpoint_file=None):
+    """
+    Compute embeddings for a list of terms in batches.
+
+    Up to EMBED_MAX_IN_FLIGHT batches are sent concurrently. When a
+    checkpoint file is given, every completed batch is appended to it and
+    terms already in it are skipped, so a crashed run resumes where it stopped.
+    """
+    embeddings = load_checkpoint(checkpoint_file)
+    if embeddings:
+        print(f"  Resuming from checkpoint: {len(embeddings)}/{len(terms)} already embedded")
+
+    pending = [t for t in dict.fromkeys(terms) if t not in embeddings]
+    batches = [
+        pending[i:i + EMBED_BATCH_SIZE]
+        for i in range(0, len(pending), EMBED_BATCH_SIZE)
+    ]
+
+    failed = None
+    truncate_torn_tail(checkpoint_file)
+    checkpoint = open(checkpoint_file, "a") if checkpoint_file else None
+    try:
+        with ThreadPoolExecutor(max_workers=EMBED_MAX_IN_FLIGHT) as executor:
+            futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    # Keep checkpointing the other batches before giving up
+                    failed = failed or e
+                    continue
+                embeddings.update(zip(batch, vectors))
+                if checkpoint:
+                    checkpoint.write(json.dumps({"terms": batch, "embeddings": vectors}) + "\n")
+                    checkpoint.flush()
+                print(f"  Computed embeddings: {len(embeddings)}/{len(terms)}")
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+    if failed:
+        raise failed
+
+    return {t: embeddings[t] for t in terms if t in embeddings}
+
+
+def current_cache_dir():
+    """
+    Directory of the live cache version named by the pointer file, CACHE_DIR
+    itself for a cache written before versioning, or None if there is none.
+    """
+    pointer_path = os.path.join(CACHE_DIR, CACHE_POINTER_FILE)
+    try:
+        with open(pointer_path, "r") as f:
+            return os.path.join(CACHE_DIR, f.read().strip())
+    except FileNotFoundError:
+        pass
+    if os.path.exists(os.path.join(CACHE_DIR, CACHE_META_FILE)):
+        return CACHE_DIR
     return None
 
 
+def _write_aside(path, write):
+    """Call write(tmp_path) on a unique name next to path, then rename it into place."""
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.{os.getpid()}-{uuid.uuid4().hex}.tmp{ext}"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_embeddings_cache(term_index):
+    """
+    Save term indexes to disk as one float32 .npy matrix and one term list per
+    category, plus a metadata header. Categories with at least ANN_MIN_TERMS
+    terms also get an IVF index.
+
+    Every save is a new version directory inside CACHE_DIR. It is written
+    under a unique staging name, renamed to v-..., and made live by replacing
+    the pointer file, so readers always see one complete version.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix="tmp-", dir=CACHE_DIR)
+    os.chmod(staging_dir, 0o755)  # mkdtemp creates it private to this user
+
+    meta = {
+        "model": EMBEDDING_MODEL,
+        "dimension": 0,
+        "dtype": CACHE_DTYPE,
+        "categories": {},
+    }
+    for category, index in term_index.items():
+        matrix = np.asarray(index["matrix"], dtype=CACHE_DTYPE)
+        if matrix.shape[0]:
+            meta["dimension"] = int(matrix.shape[1])
+        np.save(os.path.join(staging_dir, f"{category}.npy"), matrix)
+        with open(os.path.join(staging_dir, f"{category}_terms.json"), "w") as f:
+            json.dump(list(index["terms"]), f)
+        meta["categories"][category] = len(index["terms"])
+
+        if len(index["terms"]) >= ANN_MIN_TERMS:
+            if "ann" not in index:
+                print(f"Building ANN index for {category}...")
+                index["ann"] = IVFIndex.build(index["matrix"])
+            index["ann"].save(os.path.join(staging_dir, f"{category}_ivf.npz"))
+        elif QUANTIZATION and len(index["terms"]):
+            _save_quantized(staging_dir, category, matrix, QUANTIZATION)
+
+    with open(os.path.join(staging_dir, CACHE_META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    version = f"v-{time.strftime('%Y%m%dT%H%M%S')}-{os.path.basename(staging_dir)[len('tmp-'):]}"
+
+    def write_pointer(path):
+        with open(path, "w") as f:
+            f.write(version)
+
+    # Writers publish one at a time, so pruning never removes a version that
+    # another writer has renamed but not yet made live
+    with open(os.path.join(CACHE_DIR, CACHE_LOCK_FILE), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        os.rename(staging_dir, os.path.join(CACHE_DIR, version))
+        previous_dir = current_cache_dir()
+        _write_aside(os.path.join(CACHE_DIR, CACHE_POINTER_FILE), write_pointer)
+        _prune_cache_versions({version, os.path.basename(previous_dir or "")})
+    print(f"Saved embeddings cache to {os.path.join(CACHE_DIR, version)}")
+
+
+def _prune_cache_versions(keep):
+    """
+    Delete cache versions other than those in keep (the live one and the one
+    it replaced, for workers that read the old pointer), files left by the
+    unversioned layout, and abandoned staging directories. Called with the
+    cache lock held.
+    """
+    now = time.time()
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name in (CACHE_POINTER_FILE, CACHE_LOCK_FILE) or name in keep:
+            continue
+        if os.path.isdir(path):
+            stale_staging = name.startswith("tmp-") and now - os.path.getmtime(path) > STALE_STAGING_SECONDS
+            if name.startswith("v-") or stale_staging:
+                shutil.rmtree(path, ignore_errors=True)
+        elif ".tmp" not in name:
+            # Unversioned layout; open memory maps stay valid after unlinking
+            os.remove(path)
+
+
+def load_embeddings_cache():
+    """
+    Memory-map the live cache version if there is one and it was built with
+    the current embedding model. Returns term indexes or None; each index
+    records the directory it was mapped from as "cache_dir".
+    """
+    cache_dir = current_cache_dir()
+    if cache_dir is None:
+        return None
+
+    with open(os.path.join(cache_dir, CACHE_META_FILE), "r") as f:
+        meta = json.load(f)
+
+    if meta.get("model") != EMBEDDING_MODEL:
+        print(f"Embeddings cache was built with {meta.get('model')}, expected {EMBEDDING_MODEL}")
+        return None
+
+    term_index = {}
+    for category in meta.get("categories", {}):
+        matrix = np.load(os.path.join(cache_dir, f"{category}.npy"), mmap_mode="r")
+        with open(os.path.join(cache_dir, f"{category}_terms.json"), "r") as f:
+            terms = np.array(json.load(f), dtype=object)
+        term_index[category] = {"terms": terms, "matrix": matrix, "cache_dir": cache_dir}
+
+        ann_path = os.path.join(cache_dir, f"{category}_ivf.npz")
+        if os.path.exists(ann_path):
+            term_index[category]["ann"] = IVFIndex.load(ann_path)
+
+    if meta.get("dtype", CACHE_DTYPE) != CACHE_DTYPE:
+        # Caches written with EMBEDDINGS_CACHE_DTYPE=float16: rewrite once as float32
+        print(f"Converting {meta['dtype']} embeddings cache to {CACHE_DTYPE} ...")
+        save_embeddings_cache(term_index)
+        return load_embeddings_cache()
+    return term_index
+
+
+def convert_json_cache():
+    """One-time conversion of the legacy embeddings_cache.json to the binary format."""
+    if not os.path.exists(CACHE_FILE):
+        return None
+
+    print(f"Converting legacy embeddings cache {CACHE_FILE} ...")
+    with open(CACHE_FILE, "r") as f:
+        cached = json.load(f)
+
+    save_embeddings_cache(build_term_indexes(cached))
+    print(f"Converted. {CACHE_FILE} is no longer read and can be deleted")
+    return load_embeddings_cache()
+
+
 def cosine_similarity(a, b):
     """Calculate cosine similarity between two vectors."""
     a = np.array(a)
@@ -76,6 +429,129 @@ def cosine_similarity(a, b):
     return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
 
 
+def normalize_rows(matrix):
+    """L2-normalize each row of a matrix (zero rows are left as zeros)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_term_index(category_embeddings):
+    """
+    Pack a {"term": [vector]} dict into a parallel term array and a
+    pre-normalized float32 matrix, so a query is one matrix-vector product.
+    """
+    terms = np.array(list(category_embeddings.keys()), dtype=object)
+    if len(terms) == 0:
+        return {"terms": terms, "matrix": np.zeros((0, 0), dtype=np.float32)}
+
+    matrix = normalize_rows(np.array(list(category_embeddings.values()), dtype=np.float32))
+    return {"terms": terms, "matrix": matrix}
+
+
+def build_term_indexes(cache):
+    """Build a term index for every category in an embeddings cache."""
+    return {
+        category: build_term_index(category_embeddings)
+        for category, category_embeddings in cache.items()
+    }
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k == 1:
+        return np.array([int(np.argmax(scores))])
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def search_term_index(query_embedding, category, k=1):
+    """
+    Score a query vector against the terms in a category. Uses the IVF index
+    when the category has one, then a quantized scan with exact re-ranking,
+    otherwise an exact brute-force scan.
+
+    Returns:
+        list of (term, score) pairs, best first
+    """
+    index = _term_index.get(category)
+    if index is None or len(index["terms"]) == 0:
+        return []
+
+    query_vector = normalize_rows(query_embedding)
+
+    if "ann" in index:
+        ids, scores = index["ann"].search(index["matrix"], query_vector, k, ANN_N_PROBE)
+        return [(index["terms"][i], float(score)) for i, score in zip(ids, scores)]
+
+    if "quantized" in index:
+        approx = quantization.approximate_scores(index["quantized"], index["scales"], query_vector)
+        candidates = top_k_indices(approx, max(k, RERANK_CANDIDATES))
+        ids, scores = quantization.rerank(index["matrix"], query_vector, candidates, k)
+        return [(index["terms"][i], float(score)) for i, score in zip(ids, scores)]
+
+    scores = index["matrix"] @ query_vector
+
+    return [
+        (index["terms"][i], float(scores[i]))
+        for i in top_k_indices(scores, k)
+    ]
+
+
+def search_term_index_batch(query_embeddings, category, k=1):
+    """
+    search_term_index for several query vectors. The brute-force scan scores
+    all of them in one matrix-matrix product (QUERY_BLOCK_SIZE rows at a time);
+    IVF and quantized indexes are searched per query.
+
+    Returns:
+        one list of (term, score) pairs per query, best first
+    """
+    index = _term_index.get(category)
+    if index is None or len(index["terms"]) == 0:
+        return [[] for _ in query_embeddings]
+
+    if "ann" in index or "quantized" in index:
+        return [search_term_index(q, category, k) for q in query_embeddings]
+
+    query_matrix = normalize_rows(query_embeddings)
+    results = []
+    for start in range(0, len(query_matrix), QUERY_BLOCK_SIZE):
+        scores = query_matrix[start:start + QUERY_BLOCK_SIZE] @ index["matrix"].T
+        for row in scores:
+            results.append([
+                (index["terms"][i], float(row[i]))
+                for i in top_k_indices(row, k)
+            ])
+    return results
+
+
+def find_top_k_matches(query, category, k=5):
+    """
+    Find the k closest matching terms from our database.
+
+    Args:
+        query: User's input (e.g., "heart attack")
+        category: "conditions" or "interventions"
+        k: Number of matches to return
+
+    Returns:
+        list of (matched_term, confidence_score) pairs, best first
+    """
+    if category not in _term_index:
+        return []
+
+    query_embedding = get_embedding(query)
+    return search_term_index(query_embedding, category, k)
+
+
 def find_closest_match(query, category):
     """
     Find the closest matching term from our database.
@@ -87,52 +563,204 @@ def find_closest_match(query, category):
     Returns:
         (matched_term, confidence_score) or (None, 0.0) if no match
     """
-    if category not in _embeddings_cache:
+    matches = find_top_k_matches(query, category, k=1)
+    if not matches:
         return None, 0.0
 
-    query_embedding = get_embedding(query)
-    category_embeddings = _embeddings_cache[category]
+    return matches[0]
 
-    best_match = None
-    best_score = 0.0
 
-    for term, term_embedding in category_embeddings.items():
-        score = cosine_similarity(query_embedding, term_embedding)
-        if score > best_score:
-            best_score = score
-            best_match = term
+async def find_closest_match_async(query, category):
+    """find_closest_match with a non-blocking embedding call and scan."""
+    if category not in _term_index:
+        return None, 0.0
 
-    return best_match, best_score
+    query_embedding = await get_embedding_async(query)
+    matches = await asyncio.to_thread(search_term_index, query_embedding, category, 1)
+    if not matches:
+        return None, 0.0
 
+    return matches[0]
 
-def init_embedding_service():
+
+def find_closest_matches(queries, category, k=1):
     """
-    Initialize the embedding service.
-    Loads from cache if available, otherwise computes and caches.
+    Batch version of find_top_k_matches: all uncached queries are embedded in
+    one request and scored together.
+
+    Returns:
+        one list of (matched_term, confidence_score) pairs per query, best first
+    """
+    if not queries or category not in _term_index:
+        return [[] for _ in queries]
+
+    return search_term_index_batch(get_embeddings(queries), category, k)
+
+
+def refresh_embeddings_cache():
+    """
+    Bring the embeddings cache in line with unique_terms.json without a full
+    recompute: reuse cached vectors, embed only new terms, drop removed ones,
+    and rewrite the cache atomically.
+
+    Returns:
+        (term_index, report) where report is
+        {"conditions": {"reused": n, "added": n, "evicted": n}, ...}
+    """
+    cached = load_embeddings_cache() or convert_json_cache() or {}
+    terms = load_unique_terms()
+
+    term_index = {}
+    report = {}
+    for category in ("conditions", "interventions"):
+        wanted = list(dict.fromkeys(terms.get(category, [])))
+        existing = cached.get(category)
+        positions = {}
+        if existing is not None and len(existing["terms"]):
+            positions = {term: i for i, term in enumerate(existing["terms"])}
+
+        added = [t for t in wanted if t not in positions]
+        reused = len(wanted) - len(added)
+        evicted = len(positions) - reused
+
+        print(f"Refreshing {category}: {reused} reused, {len(added)} to add, {evicted} to evict")
+        new_vectors = {}
+        if added:
+            new_vectors = compute_all_embeddings(added, checkpoint_path(category))
+
+        kept = [t for t in wanted if t in positions or t in new_vectors]
+        if positions:
+            dim = existing["matrix"].shape[1]
+        elif new_vectors:
+            dim = len(next(iter(new_vectors.values())))
+        else:
+            dim = 0
+
+        matrix = np.empty((len(kept), dim), dtype=np.float32)
+        reused_rows = [i for i, t in enumerate(kept) if t in positions]
+        if reused_rows:
+            source_rows = [positions[kept[i]] for i in reused_rows]
+            matrix[reused_rows] = np.asarray(existing["matrix"][source_rows], dtype=np.float32)
+        added_rows = [i for i, t in enumerate(kept) if t not in positions]
+        if added_rows:
+            matrix[added_rows] = normalize_rows([new_vectors[kept[i]] for i in added_rows])
+
+        term_index[category] = {"terms": np.array(kept, dtype=object), "matrix": matrix}
+        report[category] = {"reused": reused, "added": len(new_vectors), "evicted": evicted}
+
+    save_embeddings_cache(term_index)
+    for category in ("conditions", "interventions"):
+        if os.path.exists(checkpoint_path(category)):
+            os.remove(checkpoint_path(category))
+
+    return load_embeddings_cache(), report
+
+
+def load_term_index(refresh=False):
+    """
+    Load term indexes from cache if available, otherwise compute and cache.
+    With refresh=True, the cache is first diffed against unique_terms.json
+    and only new terms are embedded.
     """
-    global _embeddings_cache
+    if refresh:
+        term_index, report = refresh_embeddings_cache()
+        for category, counts in report.items():
+            print(f"Refreshed {category}: {counts['reused']} reused, "
+                  f"{counts['added']} added, {counts['evicted']} evicted")
+        return term_index
 
     cached = load_embeddings_cache()
+    if cached is None:
+        cached = convert_json_cache()
     if cached:
-        _embeddings_cache = cached
-        conditions_count = len(cached.get("conditions", {}))
-        interventions_count = len(cached.get("interventions", {}))
+        for category, index in cached.items():
+            if len(index["terms"]) >= ANN_MIN_TERMS and "ann" not in index:
+                print(f"Building ANN index for {category}...")
+                index["ann"] = IVFIndex.build(index["matrix"])
+                _write_aside(os.path.join(index["cache_dir"], f"{category}_ivf.npz"), index["ann"].save)
+        conditions_count = len(cached["conditions"]["terms"]) if "conditions" in cached else 0
+        interventions_count = len(cached["interventions"]["terms"]) if "interventions" in cached else 0
         print(f"Loaded embeddings cache: {conditions_count} conditions, {interventions_count} interventions")
-        return
+        return cached
 
     print("No embeddings cache found. Computing embeddings...")
     terms = load_unique_terms()
 
     print("Computing condition embeddings...")
-    condition_embeddings = compute_all_embeddings(terms["conditions"])
+    condition_embeddings = compute_all_embeddings(
+        terms["conditions"], checkpoint_path("conditions")
+    )
 
     print("Computing intervention embeddings...")
-    intervention_embeddings = compute_all_embeddings(terms["interventions"])
+    intervention_embeddings = compute_all_embeddings(
+        terms["interventions"], checkpoint_path("interventions")
+    )
 
-    _embeddings_cache = {
+    save_embeddings_cache(build_term_indexes({
         "conditions": condition_embeddings,
         "interventions": intervention_embeddings
-    }
+    }))
+    for category in ("conditions", "interventions"):
+        if os.path.exists(checkpoint_path(category)):
+            os.remove(checkpoint_path(category))
+    return load_embeddings_cache()
+
+
+def _quantized_paths(directory, category, mode):
+    return (
+        os.path.join(directory, f"{category}_{mode}.npy"),
+        os.path.join(directory, f"{category}_{mode}_scales.npy"),
+    )
+
+
+def _save_quantized(directory, category, matrix, mode):
+    """Write the quantized matrix (and int8 row scales) next to the float32 one."""
+    quantized, scales = quantization.quantize_matrix(matrix, mode)
+    for path, array in zip(_quantized_paths(directory, category, mode), (quantized, scales)):
+        if array is None:
+            continue
+        # A reader never maps a partial file
+        _write_aside(path, lambda tmp_path: np.save(tmp_path, array))
+
+
+def quantize_term_index(term_index, mode):
+    """
+    Memory-map the quantized copy of each category matrix for the first-pass
+    scan, writing it into the cache directory first if this mode was not
+    saved with the cache. Like the float32 matrix, the pages are shared
+    between workers. Categories with an ANN index keep using it instead.
+    """
+    for category, index in term_index.items():
+        if "ann" in index or len(index["terms"]) == 0:
+            continue
+        quantized_path, scales_path = _quantized_paths(index["cache_dir"], category, mode)
+        if not os.path.exists(quantized_path):
+            print(f"Quantizing {category} to {mode}...")
+            _save_quantized(index["cache_dir"], category, index["matrix"], mode)
+
+        index["quantized"] = np.load(quantized_path, mmap_mode="r")
+        index["scales"] = np.load(scales_path, mmap_mode="r") if mode == "int8" else None
+
+        quantized_bytes = quantization.nbytes(index["quantized"], index["scales"])
+        print(f"Mapped {mode} copy of {category}: {quantized_bytes / 1e6:.1f} MB on disk, "
+              f"in addition to the {index['matrix'].nbytes / 1e6:.1f} MB float32 matrix "
+              f"used for re-ranking; both are shared between workers")
+
+
+def init_embedding_service(refresh=False, quantization_mode=None):
+    """
+    Initialize the embedding service.
+    Loads from cache if available, otherwise computes and caches.
+
+    Args:
+        refresh: Embed only terms missing from the cache (see refresh_embeddings_cache)
+        quantization_mode: "int8", "float16" or "" for none; defaults to EMBEDDINGS_QUANTIZATION
+    """
+    global _term_index
+
+    term_index = load_term_index(refresh)
+    mode = QUANTIZATION if quantization_mode is None else quantization_mode
+    if mode:
+        quantize_term_index(term_index, mode)
 
-    save_embeddings_cache(_embeddings_cache)
-    print("Embedding service initialized")
\ No newline at end of file
+    _term_index = term_index
\ No newline at end of file
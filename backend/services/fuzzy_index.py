@@ -0,0 +1,123 @@
+"""
+Fuzzy string index with the same results as difflib.get_close_matches(n=1).
+
+Candidates are generated with two vectorized upper bounds on
+SequenceMatcher.ratio(): the length bound (real_quick_ratio) over keys
+sorted by length, and a character-histogram bound (quick_ratio) over
+hashed character buckets. Only the surviving candidates are verified with
+an exact SequenceMatcher.ratio(), best bound first.
+"""
+import difflib
+import numpy as np
+
+# Configuration
+N_BUCKETS = 64
+MAX_COUNT = 255  # histogram counts are stored as uint8
+OWN_BUCKET_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789 -,()'./[]&+:;"
+OTHER_ASCII_BUCKET = N_BUCKETS - 1
+N_NON_ASCII_BUCKETS = N_BUCKETS - len(OWN_BUCKET_CHARS) - 1
+
+
+def _build_bucket_table():
+    """Map common ASCII characters to their own buckets, the rest to one shared bucket."""
+    table = np.full(128, OTHER_ASCII_BUCKET, dtype=np.int64)
+    for i, ch in enumerate(OWN_BUCKET_CHARS):
+        table[ord(ch)] = i
+    return table
+
+
+_BUCKET_TABLE = _build_bucket_table()
+
+
+def _code_points(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+
+
+def _buckets(code_points):
+    """Bucket of every code point; non-ASCII characters share a few hashed buckets."""
+    buckets = np.empty(len(code_points), dtype=np.int64)
+    ascii_mask = code_points < 128
+    buckets[ascii_mask] = _BUCKET_TABLE[code_points[ascii_mask]]
+    buckets[~ascii_mask] = len(OWN_BUCKET_CHARS) + code_points[~ascii_mask] % N_NON_ASCII_BUCKETS
+    return buckets
+
+
+class FuzzyIndex:
+    """Closest-match lookup over a fixed list of keys."""
+
+    def __init__(self, keys):
+        keys = sorted(keys, key=len)
+        self.keys = keys
+        self.lengths = np.fromiter((len(k) for k in keys), dtype=np.int64, count=len(keys))
+
+        code_points = _code_points("".join(keys))
+        rows = np.repeat(np.arange(len(keys), dtype=np.int64), self.lengths)
+        counts = np.bincount(
+            rows * N_BUCKETS + _buckets(code_points),
+            minlength=len(keys) * N_BUCKETS,
+        )
+        self.histograms = np.minimum(counts, MAX_COUNT).astype(np.uint8).reshape(len(keys), N_BUCKETS)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def candidates(self, word, cutoff):
+        """
+        Key positions whose ratio with word can reach cutoff, with their
+        upper bounds, ordered by bound (best first).
+        """
+        word_len = len(word)
+        if word_len == 0 or cutoff <= 0:
+            return np.arange(len(self.keys)), np.ones(len(self.keys))
+
+        # real_quick_ratio: 2 * min(la, lb) / (la + lb) >= cutoff
+        min_len = int(np.floor(cutoff * word_len / (2 - cutoff))) - 1
+        max_len = int(np.ceil(word_len * (2 - cutoff) / cutoff)) + 1
+        lo = np.searchsorted(self.lengths, min_len, side="left")
+        hi = np.searchsorted(self.lengths, max_len, side="right")
+
+        query_histogram = np.bincount(_buckets(_code_points(word)), minlength=N_BUCKETS)
+        query_histogram = np.minimum(query_histogram, MAX_COUNT).astype(np.uint8)
+
+        # quick_ratio: 2 * |multiset intersection| / (la + lb) >= cutoff
+        intersection = np.minimum(self.histograms[lo:hi], query_histogram).sum(axis=1, dtype=np.int64)
+        bounds = 2.0 * intersection / (self.lengths[lo:hi] + word_len)
+
+        keep = np.nonzero(bounds >= cutoff)[0]
+        order = keep[np.argsort(-bounds[keep], kind="stable")]
+        return order + lo, bounds[order]
+
+    def get_close_match(self, word, cutoff):
+        """
+        Best key with SequenceMatcher ratio >= cutoff, like
+        difflib.get_close_matches(word, keys, n=1, cutoff=cutoff).
+
+        Returns:
+            (key, ratio) or (None, 0.0) if nothing is close enough
+        """
+        if len(word) > MAX_COUNT:
+            # Histogram counts saturate; fall back to the full scan
+            matches = difflib.get_close_matches(word, self.keys, n=1, cutoff=cutoff)
+            if not matches:
+                return None, 0.0
+            s = difflib.SequenceMatcher(None, matches[0], word)
+            return matches[0], s.ratio()
+
+        positions, bounds = self.candidates(word, cutoff)
+
+        s = difflib.SequenceMatcher()
+        s.set_seq2(word)
+        best = None
+        for position, bound in zip(positions, bounds):
+            if best is not None and bound < best[0]:
+                break
+            key = self.keys[position]
+            s.set_seq1(key)
+            score = s.ratio()
+            # Ties go to the larger key, as with get_close_matches' nlargest
+            if score >= cutoff and (best is None or (score, key) > best):
+                best = (score, key)
+
+        if best is None:
+            return None, 0.0
+        return best[1], best[0]
@@ -1,24 +1,74 @@
+import asyncio
+import bisect
 import difflib
 import json
 import os
+import sys
+from array import array
 from typing import Optional
 
+from services.cache import LRUCache
+from services.fuzzy_index import FuzzyIndex
+
 # Global cache
-_synonym_cache: dict = None
-_mesh_keys: list = None
+# Synonym groups are stored once: key -> group id, and each group is a run of
+# ids into a single pool of interned strings.
+_key_groups: dict = None      # {"lowercase synonym": group_id}
+_strings: list = None         # string pool
+_group_offsets: array = None  # group i is _group_members[offsets[i]:offsets[i + 1]]
+_group_members: array = None  # string ids
+_fuzzy_index: FuzzyIndex = None
+
+# Tree-number hierarchy: sorted tree numbers, so a subtree is one contiguous range
+_tree_numbers: list = None                # ["C04", "C04.588", ...] sorted
+_tree_descriptors: array = None           # descriptor (group) id of each tree number
+_descriptor_tree_offsets: array = None    # descriptor i's tree numbers are at
+_descriptor_tree_positions: array = None  # positions[offsets[i]:offsets[i + 1]]
+_descriptor_names: list = None            # preferred name per descriptor
 
 # Paths
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 SYNONYMS_FILE = os.path.join(DATA_DIR, "mesh_synonyms.json")
+TREE_FILE = os.path.join(DATA_DIR, "mesh_tree.json")
 
 # Thresholds
 FUZZY_CUTOFF = 0.85
 EMBEDDING_THRESHOLD = 0.60
+# Different drugs in one class embed close together (two statins easily pass
+# 0.60), so an unknown drug would be expanded with another drug's synonyms.
+# Interventions need a near-identical neighbour; set above 1 to disable.
+INTERVENTION_EMBEDDING_THRESHOLD = float(os.getenv("INTERVENTION_EMBEDDING_THRESHOLD", "0.85"))
+EMBEDDING_THRESHOLDS = {"conditions": EMBEDDING_THRESHOLD, "interventions": INTERVENTION_EMBEDDING_THRESHOLD}
+
+# Tree branches that hold conditions: C = Diseases, F03 = Mental Disorders
+CONDITION_TREE_PREFIXES = ("C", "F03")
+
+# Memoized synonym resolution, shared by the NLP service and the query builder
+SYNONYM_CACHE_SIZE = int(os.getenv("SYNONYM_CACHE_SIZE", "4096"))
+SYNONYM_CACHE_TTL = int(os.getenv("SYNONYM_CACHE_TTL", "3600"))  # seconds
+_resolution_cache = LRUCache(SYNONYM_CACHE_SIZE, ttl=SYNONYM_CACHE_TTL)
+
+
+def _normalize_synonym_data(data: dict) -> dict:
+    """Convert the legacy {key: [synonyms]} format to {"groups": [...], "keys": {...}}."""
+    if data.get("format") == 2:
+        return data
+
+    groups = []
+    group_ids = {}
+    keys = {}
+    for key, synonyms in data.items():
+        group = tuple(synonyms)
+        if group not in group_ids:
+            group_ids[group] = len(groups)
+            groups.append(synonyms)
+        keys[key] = group_ids[group]
+    return {"format": 2, "groups": groups, "keys": keys}
 
 
 def init_mesh_service() -> None:
     """Loads MeSH synonym dictionary into memory. Called on app startup."""
-    global _synonym_cache, _mesh_keys
+    global _key_groups, _strings, _group_offsets, _group_members, _fuzzy_index
 
     if not os.path.exists(SYNONYMS_FILE):
         raise FileNotFoundError(
@@ -27,31 +77,173 @@ def init_mesh_service() -> None:
         )
 
     with open(SYNONYMS_FILE, "r") as f:
-        _synonym_cache = json.load(f)
-
-    _mesh_keys = list(_synonym_cache.keys())
-    print(f"Loaded {len(_synonym_cache)} MeSH synonym mappings")
+        data = _normalize_synonym_data(json.load(f))
+
+    strings = []
+    string_ids = {}
+    offsets = array("I", [0])
+    members = array("I")
+    for group in data["groups"]:
+        for synonym in group:
+            string_id = string_ids.get(synonym)
+            if string_id is None:
+                string_id = string_ids[synonym] = len(strings)
+                strings.append(sys.intern(synonym))
+            members.append(string_id)
+        offsets.append(len(members))
+
+    _strings = strings
+    _group_offsets = offsets
+    _group_members = members
+    _key_groups = {sys.intern(key): group_id for key, group_id in data["keys"].items()}
+    _fuzzy_index = FuzzyIndex(_key_groups.keys())
+    _resolution_cache.clear()
+    print(f"Loaded {len(_key_groups)} MeSH synonym mappings "
+          f"({len(offsets) - 1} groups, {len(strings)} unique strings)")
+
+    _load_tree_index(len(offsets) - 1)
+
+
+def _load_tree_index(group_count: int) -> None:
+    """Load the tree-number index written by build_mesh_cache.py, if present."""
+    global _tree_numbers, _tree_descriptors, _descriptor_tree_offsets
+    global _descriptor_tree_positions, _descriptor_names
+
+    _tree_numbers = None
+    if not os.path.exists(TREE_FILE):
+        print(f"MeSH tree index not found: {TREE_FILE} (descendant expansion disabled)")
+        return
+
+    with open(TREE_FILE, "r") as f:
+        data = json.load(f)
+
+    # Group ids are descriptor indexes only if both files come from the same build
+    if data["descriptor_count"] != group_count:
+        print("MeSH tree index does not match mesh_synonyms.json (descendant expansion disabled)")
+        return
+
+    descriptors = array("I", data["descriptor_ids"])
+    counts = array("I", [0]) * (data["descriptor_count"] + 1)
+    for d in descriptors:
+        counts[d + 1] += 1
+    for i in range(1, len(counts)):
+        counts[i] += counts[i - 1]
+    positions = array("I", [0]) * len(descriptors)
+    fill = array("I", counts)
+    for position, d in enumerate(descriptors):
+        positions[fill[d]] = position
+        fill[d] += 1
+
+    _tree_numbers = [sys.intern(tn) for tn in data["tree_numbers"]]
+    _tree_descriptors = descriptors
+    _descriptor_tree_offsets = counts
+    _descriptor_tree_positions = positions
+    _descriptor_names = data["names"]
+    print(f"Loaded {len(_tree_numbers)} MeSH tree numbers")
+
+
+def _group_synonyms(key: str) -> Optional[list]:
+    """Synonym group for an exact lowercase key, as a fresh list."""
+    group_id = _key_groups.get(key)
+    if group_id is None:
+        return None
+    start, end = _group_offsets[group_id], _group_offsets[group_id + 1]
+    return [_strings[i] for i in _group_members[start:end]]
 
 
 def mesh_lookup(term: str) -> Optional[list]:
 
-    if _synonym_cache is None:
+    if _key_groups is None:
         init_mesh_service()
 
-    return _synonym_cache.get(term.lower())
+    return _group_synonyms(term.lower())
 
 
-def fuzzy_mesh_lookup(term: str) -> Optional[list]:
+def get_descendants(term: str, depth: Optional[int] = None) -> list[str]:
+    """
+    Preferred names of the descriptors below a term in the MeSH hierarchy.
+
+    Each of the term's tree numbers is a prefix; its subtree is found with
+    two binary searches over the sorted tree numbers, so a lookup is
+    O(log n + k). depth limits how many levels down to go (None = all):
+    below the last level each node's subtree is skipped with one more
+    binary search, so the deeper levels are never scanned.
+    """
+    if _key_groups is None:
+        init_mesh_service()
+    if not term or not term.strip() or _tree_numbers is None:
+        return []
+    if depth is not None and depth < 1:
+        return []
 
-    if _mesh_keys is None:
+    descriptor = _key_groups.get(term.strip().lower())
+    if descriptor is None:
+        info = get_synonyms_with_info(term)
+        if info["match_type"] == "none":
+            return []
+        descriptor = _key_groups.get(info["matched_term"].lower())
+        if descriptor is None:
+            return []
+
+    seen = {descriptor}
+    names = []
+    start, end = _descriptor_tree_offsets[descriptor], _descriptor_tree_offsets[descriptor + 1]
+    for position in _descriptor_tree_positions[start:end]:
+        prefix = _tree_numbers[position]
+        level = prefix.count(".")
+        # Children start with "<prefix>."; "/" sorts right after "."
+        lo = bisect.bisect_left(_tree_numbers, prefix + ".")
+        hi = bisect.bisect_left(_tree_numbers, prefix + "/", lo)
+        i = lo
+        while i < hi:
+            tree_number = _tree_numbers[i]
+            below = tree_number.count(".") - level
+            if depth is None or below <= depth:
+                child = _tree_descriptors[i]
+                if child not in seen and _descriptor_names[child]:
+                    seen.add(child)
+                    names.append(_descriptor_names[child])
+            if depth is not None and below >= depth:
+                # Deepest wanted level (or deeper, where a parent number is
+                # missing): jump past this node's whole subtree
+                i = bisect.bisect_left(_tree_numbers, tree_number + "/", i + 1, hi)
+            else:
+                i += 1
+
+    return names
+
+
+def is_condition_term(term: str) -> bool:
+    """
+    True if term is an exact MeSH key whose descriptor sits under one of
+    CONDITION_TREE_PREFIXES (diseases, mental disorders). Without the tree
+    index every key counts.
+    """
+    if _key_groups is None:
         init_mesh_service()
 
-    matches = difflib.get_close_matches(
-        term.lower(), _mesh_keys, n=1, cutoff=FUZZY_CUTOFF
+    descriptor = _key_groups.get(term.lower())
+    if descriptor is None:
+        return False
+    if _tree_numbers is None:
+        return True
+
+    start, end = _descriptor_tree_offsets[descriptor], _descriptor_tree_offsets[descriptor + 1]
+    return any(
+        _tree_numbers[position].startswith(CONDITION_TREE_PREFIXES)
+        for position in _descriptor_tree_positions[start:end]
     )
 
-    if matches:
-        return _synonym_cache.get(matches[0])
+
+def fuzzy_mesh_lookup(term: str) -> Optional[list]:
+
+    if _fuzzy_index is None:
+        init_mesh_service()
+
+    match, _ = _fuzzy_index.get_close_match(term.lower(), FUZZY_CUTOFF)
+
+    if match:
+        return _group_synonyms(match)
 
     return None
 
@@ -60,52 +252,147 @@ def get_synonyms(term: str) -> list[str]:
     if not term or not term.strip():
         return []
 
+    return get_synonyms_with_info(term)["synonyms"]
+
+
+def get_synonyms_with_info(term: str, category: str = "conditions") -> dict:
+    """
+    Get synonyms with match metadata (useful for debugging / UI display).
+    category picks the term embeddings used by the fallback layer
+    ("conditions" or "interventions"). Results are memoized per category and
+    lowercase term (see SYNONYM_CACHE_TTL).
+
+    Returns dict with: original, matched_term, match_type, confidence, synonyms
+    """
+    if not term or not term.strip():
+        return _empty_info(term)
+
     term = term.strip()
+    key = f"{category}:{term.lower()}"  # every lookup layer is case-insensitive
 
-    # Layer 1: Direct MeSH lookup
-    synonyms = mesh_lookup(term)
-    if synonyms:
-        return synonyms
+    info = _resolution_cache.get(key)
+    if info is None:
+        info, cacheable = _resolve_synonyms(term, category)
+        if cacheable:
+            _resolution_cache.set(key, info)
 
-    # Layer 1.5: Fuzzy string match against MeSH keys
-    synonyms = fuzzy_mesh_lookup(term)
-    if synonyms:
-        return synonyms
+    return _copy_info(term, info)
 
-    # Layer 2: Embedding fallback — match against existing condition embeddings
-    try:
-        from services.embedding_service import find_closest_match
 
-        matched_term, confidence = find_closest_match(term, "conditions")
+async def get_synonyms_with_info_async(term: str, category: str = "conditions") -> dict:
+    """get_synonyms_with_info with a non-blocking embedding fallback."""
+    if not term or not term.strip():
+        return _empty_info(term)
+
+    term = term.strip()
+    key = f"{category}:{term.lower()}"
+
+    info = _resolution_cache.get(key)
+    if info is None:
+        info, cacheable = await _resolve_synonyms_async(term, category)
+        if cacheable:
+            _resolution_cache.set(key, info)
+
+    return _copy_info(term, info)
+
+
+def _empty_info(term) -> dict:
+    return {
+        "original": term,
+        "matched_term": None,
+        "match_type": "none",
+        "confidence": 0.0,
+        "synonyms": [],
+    }
+
 
-        if matched_term and confidence >= EMBEDDING_THRESHOLD:
-            synonyms = mesh_lookup(matched_term)
-            if synonyms:
-                return synonyms
+def _copy_info(term: str, info: dict) -> dict:
+    """Fresh copy so callers can't mutate the cached entry."""
+    result = dict(info, original=term, synonyms=list(info["synonyms"]))
+    if result["match_type"] == "exact":
+        result["matched_term"] = term
+    elif result["match_type"] == "none":
+        result["synonyms"] = [term]
+    return result
+
+
+def prefetch_embedding_fallback(lookups: list) -> None:
+    """
+    Embed, in one request, every (term, category) lookup that is not memoized
+    and will miss the exact and fuzzy layers, so their embedding fallbacks
+    are query embedding cache hits.
+    """
+    misses = []
+    for term, category in lookups:
+        term = (term or "").strip()
+        if not term or f"{category}:{term.lower()}" in _resolution_cache:
+            continue
+        if _embedding_threshold(category) > 1:
+            continue
+        if _resolve_lexical(term) is None:
+            misses.append(term)
+    misses = list(dict.fromkeys(misses))
+    if len(misses) < 2:
+        return  # a single miss costs one round-trip either way
+
+    try:
+        from services.embedding_service import get_embeddings
+        get_embeddings(misses)
     except Exception as e:
-        print(f"Embedding fallback failed: {e}")
+        print(f"Embedding prefetch failed: {e}")
+
 
-    # Layer 3: No match — return original term
-    return [term]
+def get_synonym_cache_stats() -> dict:
+    """Hit/miss counters for memoized synonym resolution."""
+    return _resolution_cache.stats()
 
 
-def get_synonyms_with_info(term: str) -> dict:
+def _resolve_synonyms(term: str, category: str = "conditions") -> tuple[dict, bool]:
     """
-    Get synonyms with match metadata (useful for debugging / UI display).
+    Run the lookup layers for a stripped term.
 
-    Returns dict with: original, matched_term, match_type, confidence, synonyms
+    Returns (info, cacheable); results are not cacheable when the embedding
+    fallback failed, so a transient API error isn't remembered as "no match".
     """
-    if not term or not term.strip():
-        return {
-            "original": term,
-            "matched_term": None,
-            "match_type": "none",
-            "confidence": 0.0,
-            "synonyms": [],
-        }
+    info = _resolve_lexical(term)
+    if info:
+        return info, True
+    if _embedding_threshold(category) > 1:
+        return _no_match(term), True
 
-    term = term.strip()
+    # Layer 2: Embedding fallback — match against existing term embeddings
+    try:
+        from services.embedding_service import find_closest_match
+
+        matched_term, confidence = find_closest_match(term, category)
+    except Exception as e:
+        print(f"Embedding fallback failed: {e}")
+        return _no_match(term), False
+
+    return _embedding_match(term, matched_term, confidence, category), True
 
+
+async def _resolve_synonyms_async(term: str, category: str = "conditions") -> tuple[dict, bool]:
+    """_resolve_synonyms awaiting the embedding fallback; the fuzzy scan runs in a thread."""
+    info = await asyncio.to_thread(_resolve_lexical, term)
+    if info:
+        return info, True
+    if _embedding_threshold(category) > 1:
+        return _no_match(term), True
+
+    try:
+        from services.embedding_service import find_closest_match_async
+
+        matched_term, confidence = await find_closest_match_async(term, category)
+    except Exception as e:
+        print(f"Embedding fallback failed: {e}")
+        return _no_match(term), False
+
+    return _embedding_match(term, matched_term, confidence, category), True
+
+
+def _resolve_lexical(term: str) -> Optional[dict]:
+    """Layers 1 and 1.5: exact and fuzzy MeSH key matches (no I/O)."""
     # Layer 1: Direct MeSH lookup
     synonyms = mesh_lookup(term)
     if synonyms:
@@ -117,50 +404,53 @@ def get_synonyms_with_info(term: str) -> dict:
             "synonyms": synonyms,
         }
 
-    # Fuzzy string match
-    if _mesh_keys is None:
+    # Layer 1.5: Fuzzy string match against MeSH keys
+    if _fuzzy_index is None:
         init_mesh_service()
 
-    matches = difflib.get_close_matches(
-        term.lower(), _mesh_keys, n=1, cutoff=FUZZY_CUTOFF
-    )
-    if matches:
-        synonyms = _synonym_cache.get(matches[0])
+    match, _ = _fuzzy_index.get_close_match(term.lower(), FUZZY_CUTOFF)
+    if match:
+        synonyms = _group_synonyms(match)
         if synonyms:
             return {
                 "original": term,
-                "matched_term": matches[0],
+                "matched_term": match,
                 "match_type": "fuzzy",
                 "confidence": difflib.SequenceMatcher(
-                    None, term.lower(), matches[0]
+                    None, term.lower(), match
                 ).ratio(),
                 "synonyms": synonyms,
             }
 
-    # Layer 2: Embedding fallback
-    try:
-        from services.embedding_service import find_closest_match
+    return None
+
+
+def _embedding_threshold(category: str) -> float:
+    return EMBEDDING_THRESHOLDS.get(category, EMBEDDING_THRESHOLD)
+
+
+def _embedding_match(term: str, matched_term: Optional[str], confidence: float,
+                     category: str = "conditions") -> dict:
+    """Layer 2 result, or Layer 3 (no match — return original term)."""
+    if matched_term and confidence >= _embedding_threshold(category):
+        synonyms = mesh_lookup(matched_term)
+        if synonyms:
+            return {
+                "original": term,
+                "matched_term": matched_term,
+                "match_type": "embedding",
+                "confidence": confidence,
+                "synonyms": synonyms,
+            }
+
+    return _no_match(term)
 
-        matched_term, confidence = find_closest_match(term, "conditions")
-
-        if matched_term and confidence >= EMBEDDING_THRESHOLD:
-            synonyms = mesh_lookup(matched_term)
-            if synonyms:
-                return {
-                    "original": term,
-                    "matched_term": matched_term,
-                    "match_type": "embedding",
-                    "confidence": confidence,
-                    "synonyms": synonyms,
-                }
-    except Exception as e:
-        print(f"Embedding fallback failed: {e}")
 
-    # No match
+def _no_match(term: str) -> dict:
     return {
         "original": term,
         "matched_term": None,
         "match_type": "none",
         "confidence": 0.0,
         "synonyms": [term],
-    }
\ No newline at end of file
+    }
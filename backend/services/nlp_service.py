@@ -1,12 +1,32 @@
+import asyncio
+import copy
+import hashlib
 import json
-from openai import OpenAI
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
+from services.cache import LRUCache, SQLiteCache, TieredCache
 
 load_dotenv()
 
 #Configuration
 LLM_MODEL = "gpt-4o-mini"
-client = OpenAI()
+BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
+EXTRACTION_CACHE_SIZE = int(os.getenv("LLM_EXTRACTION_CACHE_SIZE", "2048"))
+# Persistent tier for LLM extractions; set to "" to keep the cache in memory only
+EXTRACTION_CACHE_DB = os.getenv(
+    "LLM_EXTRACTION_CACHE_DB", os.path.join(BASE_DIR, "data", "llm_extractions.db")
+)
+# Conditions/interventions resolved concurrently per request, across all requests
+RESOLVE_MAX_WORKERS = int(os.getenv("ENTITY_RESOLVE_WORKERS", "8"))
+# A slow OpenAI fails the extraction in seconds instead of the client's 600 s default
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))  # seconds
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+client = OpenAI(timeout=LLM_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
+# only used on the services.async_runtime loop
+async_client = AsyncOpenAI(timeout=LLM_TIMEOUT, max_retries=OPENAI_MAX_RETRIES)
 
 SYSTEM_PROMPT = """You are a clinical trials search assistant. Extract search filters from natural language queries.
 
@@ -176,25 +196,112 @@ Output: {"condition": "breast cancer", "phase": "PHASE3", "status": "RECRUITING"
 """
 
 
+def _build_extraction_cache():
+    """LRU cache for LLM extraction results, backed by SQLite when configured."""
+    disk = SQLiteCache(EXTRACTION_CACHE_DB, table="llm_extractions") if EXTRACTION_CACHE_DB else None
+    return TieredCache(LRUCache(EXTRACTION_CACHE_SIZE), disk)
+
+
+_extraction_cache = _build_extraction_cache()  # {sha256(model, prompt, query): entities}
+
+
+def normalize_query(query):
+    """Collapse whitespace; casing is kept because entity values echo the query."""
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def extraction_cache_key(query):
+    """
+    Cache key for a normalized query. The model and system prompt are part of
+    the hash, so changing either one invalidates every cached extraction.
+    """
+    digest = hashlib.sha256()
+    for part in (LLM_MODEL, SYSTEM_PROMPT, query):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_extraction_cache_stats():
+    """Hit/miss counters for the LLM extraction cache."""
+    return _extraction_cache.stats()
+
+
+def _extraction_request(query):
+    """chat.completions.create arguments for an extraction call."""
+    return {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": query}
+        ],
+        "temperature": 0,
+        "response_format": {"type": "json_object"}
+    }
+
+
+def _parse_extraction(response):
+    return json.loads(response.choices[0].message.content)
+
+
 def call_openai(query):
     """Call OpenAI to extract entities from a natural language query."""
     try:
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": query}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        content = response.choices[0].message.content
-        return json.loads(content)
+        return _parse_extraction(client.chat.completions.create(**_extraction_request(query)))
+    except Exception as e:
+        print(f"OpenAI API error: {e}")
+        return {}
+
+
+async def call_openai_async(query):
+    """call_openai on the async client."""
+    try:
+        return _parse_extraction(await async_client.chat.completions.create(**_extraction_request(query)))
     except Exception as e:
         print(f"OpenAI API error: {e}")
         return {}
 
 
+def _remember_extraction(key, entities):
+    """Cache a non-empty extraction; empty ones (API errors, nothing found) aren't cached."""
+    if entities:
+        _extraction_cache.set(key, entities)
+    return entities
+
+
+def cached_call_openai(query):
+    """
+    call_openai with exact-match caching. temperature=0 and a fixed prompt make
+    the extraction deterministic, so repeat searches and page 2..N skip the LLM.
+    Empty results (API errors, nothing found) are not cached.
+    """
+    query = normalize_query(query)
+    key = extraction_cache_key(query)
+
+    entities = _extraction_cache.get(key)
+    if entities is None:
+        entities = _remember_extraction(key, call_openai(query))
+
+    # extract_entities normalizes in place; never hand out the cached dict
+    return copy.deepcopy(entities)
+
+
+async def cached_call_openai_async(query):
+    """
+    cached_call_openai on the async client; same cache. Cache reads and
+    writes can hit SQLite, so they run off the event loop.
+    """
+    query = normalize_query(query)
+    key = extraction_cache_key(query)
+
+    entities = await asyncio.to_thread(_extraction_cache.get, key)
+    if entities is None:
+        entities = await call_openai_async(query)
+        entities = await asyncio.to_thread(_remember_extraction, key, entities)
+
+    return copy.deepcopy(entities)
+
+
 def generate_interpretation(entities):
     """Generate a human-readable interpretation of extracted entities."""
     if not entities:
@@ -267,58 +374,147 @@ def ensure_list(value):
     return [value]
 
 
+# Entities that are always arrays (date is a dict)
+ARRAY_KEYS = {"phase", "status", "condition", "intervention",
+              "location", "sponsor", "age_group", "keyword"}
+
+# Entities resolved to MeSH synonyms: {entity: embedding category}
+RESOLVED_ENTITIES = {"condition": "conditions", "intervention": "interventions"}
+
+_resolve_pool = ThreadPoolExecutor(max_workers=RESOLVE_MAX_WORKERS, thread_name_prefix="resolve")
+
+
 def extract_entities(query):
     """
     Main entry point for entity extraction.
 
-    1. Call OpenAI to extract raw entities
+    1. Extract raw entities: rule-based fast path, else OpenAI (cached per
+       normalized query)
     2. Normalize all entities to arrays
     3. Use embedding matching for each condition/intervention
-    4. Attach MeSH synonyms for each condition
+    4. Attach MeSH synonyms for each condition/intervention
     5. Generate human-readable interpretation
     6. Return complete result
     """
-    # Step 1: LLM extraction
-    raw_entities = call_openai(query)
+    # Step 1: Rule-based fast path, LLM extraction when the rules aren't confident
+    from services.rule_extractor import fast_path_extract
+    raw_entities = fast_path_extract(query)
+    if raw_entities is None:
+        raw_entities = cached_call_openai(query)
 
     if not raw_entities:
-        return {
-            "success": False,
-            "entities": {},
-            "interpretation": "Could not extract any search filters from your query.",
-            "raw_query": query
-        }
+        return _no_entities_result(query)
 
     # Step 2: Normalize all entities to arrays (except date which is a dict)
-    ARRAY_KEYS = {"phase", "status", "condition", "intervention",
-                  "location", "sponsor", "age_group", "keyword"}
+    _normalize_entities(raw_entities)
+
+    # Steps 3-4: MeSH synonym lookup for each condition/intervention. The
+    # resolved synonyms travel with the entities so build_query doesn't
+    # resolve them again.
+    jobs = _resolution_jobs(raw_entities)
+    if jobs:
+        try:
+            from services.mesh_service import get_synonyms_with_info, prefetch_embedding_fallback
+
+            # Terms that miss the exact and fuzzy layers share one embedding request
+            prefetch_embedding_fallback(_prefetch_lookups(jobs))
+            futures = [
+                _resolve_pool.submit(get_synonyms_with_info, term, RESOLVED_ENTITIES[entity])
+                for entity, term in jobs
+            ]
+            _attach_synonyms(raw_entities, jobs, [f.exception() or f.result() for f in futures])
+        except Exception as e:
+            print(f"MeSH synonym lookup failed: {e}")
+
+    # Steps 5-6
+    return _entities_result(query, raw_entities)
+
+
+async def extract_entities_async(query):
+    """
+    extract_entities for the async pipeline: the LLM call is awaited and the
+    conditions/interventions are resolved concurrently, so their embedding
+    fallbacks overlap. The rule extractor (which loads its vocabularies on
+    first use) runs in a thread.
+    """
+    from services.rule_extractor import fast_path_extract
+    raw_entities = await asyncio.to_thread(fast_path_extract, query)
+    if raw_entities is None:
+        raw_entities = await cached_call_openai_async(query)
+
+    if not raw_entities:
+        return _no_entities_result(query)
+
+    _normalize_entities(raw_entities)
+
+    jobs = _resolution_jobs(raw_entities)
+    if jobs:
+        try:
+            from services.mesh_service import get_synonyms_with_info_async, prefetch_embedding_fallback
+
+            # One bulk embedding request instead of one per missed term
+            await asyncio.to_thread(prefetch_embedding_fallback, _prefetch_lookups(jobs))
+            infos = await asyncio.gather(*(
+                get_synonyms_with_info_async(term, RESOLVED_ENTITIES[entity])
+                for entity, term in jobs
+            ), return_exceptions=True)
+            _attach_synonyms(raw_entities, jobs, infos)
+        except Exception as e:
+            print(f"MeSH synonym lookup failed: {e}")
+
+    return _entities_result(query, raw_entities)
+
+
+def _normalize_entities(raw_entities):
+    """Wrap ARRAY_KEYS values in lists and default query_type to "search"."""
     for key in ARRAY_KEYS:
         if key in raw_entities:
             raw_entities[key] = ensure_list(raw_entities[key])
 
-    # Default query_type to "search"
     if "query_type" not in raw_entities:
         raw_entities["query_type"] = "search"
 
-        # MeSH synonym lookup for each condition
-        try:
-            from services.mesh_service import get_synonyms_with_info
-            synonyms_map = {}
-            for cond in conditions:
-                mesh_info = get_synonyms_with_info(cond)
-                if mesh_info.get("synonyms") and len(mesh_info["synonyms"]) > 1:
-                    synonyms_map[cond] = mesh_info["synonyms"]
-            if synonyms_map:
-                raw_entities["condition_synonyms"] = synonyms_map
-        except Exception as e:
-            print(f"MeSH synonym lookup failed: {e}")
 
-    # Step 5: Generate interpretation
-    interpretation = generate_interpretation(raw_entities)
+def _resolution_jobs(raw_entities):
+    """(entity, term) for every condition and intervention to resolve."""
+    return [
+        (entity, term)
+        for entity in RESOLVED_ENTITIES
+        for term in raw_entities.get(entity, [])
+    ]
+
+
+def _prefetch_lookups(jobs):
+    return [(term, RESOLVED_ENTITIES[entity]) for entity, term in jobs]
+
+
+def _attach_synonyms(raw_entities, jobs, infos):
+    """
+    Store the MeSH synonyms of each term that has more than itself, as
+    condition_synonyms / intervention_synonyms. An exception in infos only
+    loses that term's synonyms.
+    """
+    for (entity, term), mesh_info in zip(jobs, infos):
+        if isinstance(mesh_info, BaseException):
+            print(f"MeSH synonym lookup failed for {term!r}: {mesh_info}")
+            continue
+        if mesh_info.get("synonyms") and len(mesh_info["synonyms"]) > 1:
+            raw_entities.setdefault(f"{entity}_synonyms", {})[term] = mesh_info["synonyms"]
+
+
+def _no_entities_result(query):
+    return {
+        "success": False,
+        "entities": {},
+        "interpretation": "Could not extract any search filters from your query.",
+        "raw_query": query
+    }
+
 
+def _entities_result(query, raw_entities):
     return {
         "success": True,
         "entities": raw_entities,
-        "interpretation": interpretation,
+        "interpretation": generate_interpretation(raw_entities),
         "raw_query": query
     }
@@ -0,0 +1,111 @@
+"""
+Cursor pagination with a point-in-time (PIT) and search_after.
+
+Deep from/size pages make every shard collect and sort from + size hits,
+and results shift when the index refreshes between clicks. A cursor pins
+the search to a PIT snapshot and resumes after the sort values of the last
+hit, so every page costs the same and stays consistent.
+
+The cursor token is opaque to clients: URL-safe base64 of a small JSON
+state (PIT id, search_after values, page, size, query fingerprint).
+"""
+import base64
+import hashlib
+import json
+import os
+
+from services.query_builder import MAX_PAGE_SIZE
+
+# Configuration
+PIT_KEEP_ALIVE = os.getenv("SEARCH_PIT_KEEP_ALIVE", "5m")
+TIEBREAKER_SORT = {"nct_id": "asc"}  # unique per trial, so search_after never skips ties
+
+
+class CursorError(ValueError):
+    """Raised for cursor tokens that are malformed or belong to another query."""
+
+
+def query_fingerprint(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(pit_id, search_after, page, size, query):
+    state = {
+        "pit": pit_id,
+        "after": search_after,
+        "page": page,
+        "size": size,
+        "q": query_fingerprint(query),
+    }
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _is_positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+def decode_cursor(token, query):
+    """
+    The token is client-controlled, so every field is checked: page and
+    size must be positive ints with size at most MAX_PAGE_SIZE.
+
+    Returns:
+        {"pit", "after", "page", "size"} for a token issued for query
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        state = json.loads(raw)
+        cursor = {key: state[key] for key in ("pit", "after", "page", "size")}
+        fingerprint = state["q"]
+    except Exception:
+        raise CursorError("Invalid cursor")
+
+    if fingerprint != query_fingerprint(query):
+        raise CursorError("Cursor does not belong to this query")
+    if not isinstance(cursor["pit"], str) or not isinstance(cursor["after"], list):
+        raise CursorError("Invalid cursor")
+    if not _is_positive_int(cursor["page"]) or not _is_positive_int(cursor["size"]):
+        raise CursorError("Invalid cursor")
+    if cursor["size"] > MAX_PAGE_SIZE:
+        raise CursorError(f"Cursor page size is above {MAX_PAGE_SIZE}")
+    return cursor
+
+
+def build_cursor_body(es_query, pit_id, search_after=None):
+    """
+    Turn a build_query body into a PIT page: no from and no index, the
+    nct_id tiebreaker appended to the sort, and search_after if resuming.
+    es_query must be a fresh top-level dict (build_query returns one).
+    """
+    es_query.pop("from", None)
+    es_query["sort"] = list(es_query["sort"]) + [TIEBREAKER_SORT]
+    es_query["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+    if search_after is not None:
+        es_query["search_after"] = search_after
+    return es_query
+
+
+def next_cursor(response, page, size, query):
+    """Cursor for the page after this one, or None on the last page."""
+    hits = response["hits"]["hits"]
+    total = response["hits"]["total"]
+    if len(hits) < size:
+        return None
+    # An "eq" total tells us this page was the last; "gte" is only a lower bound
+    if total.get("relation") == "eq" and page * size >= total["value"]:
+        return None
+    return encode_cursor(response["pit_id"], hits[-1]["sort"], page + 1, size, query)
+
+
+async def open_pit(es, index):
+    response = await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)
+    return response["id"]
+
+
+async def close_pit(es, pit_id):
+    """Release a PIT early; otherwise it expires after PIT_KEEP_ALIVE."""
+    try:
+        await es.close_point_in_time(id=pit_id)
+    except Exception as e:
+        print(f"Closing point-in-time failed: {e}")
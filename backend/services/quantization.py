@@ -0,0 +1,69 @@
+"""
+Quantized copies of pre-normalized term matrices for a cheap first-pass scan.
+
+- int8: each row scaled by its own max magnitude into [-127, 127]
+- float16: plain half-precision copy
+
+Approximate scores are only used to pick candidates; the final ranking is
+recomputed exactly against the full-precision matrix.
+"""
+import numpy as np
+
+# Configuration
+QUANTIZATION_MODES = ("int8", "float16")
+SCAN_CHUNK_SIZE = 4096
+
+
+def quantize_matrix(matrix, mode):
+    """
+    Quantize a matrix row by row.
+
+    Returns:
+        (quantized_matrix, scales) where scales is None for float16
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+
+    quantized = np.empty(matrix.shape, dtype=np.int8 if mode == "int8" else np.float16)
+    scales = np.empty(matrix.shape[0], dtype=np.float32) if mode == "int8" else None
+
+    for start in range(0, matrix.shape[0], SCAN_CHUNK_SIZE):
+        chunk = np.asarray(matrix[start:start + SCAN_CHUNK_SIZE], dtype=np.float32)
+        end = start + len(chunk)
+        if mode == "float16":
+            quantized[start:end] = chunk
+            continue
+        chunk_scales = np.abs(chunk).max(axis=1) / 127.0
+        chunk_scales[chunk_scales == 0] = 1.0
+        quantized[start:end] = np.round(chunk / chunk_scales[:, None])
+        scales[start:end] = chunk_scales
+
+    return quantized, scales
+
+
+def approximate_scores(quantized, scales, query_vector):
+    """Dot products of a query with every quantized row, computed in chunks."""
+    scores = np.empty(quantized.shape[0], dtype=np.float32)
+    for start in range(0, quantized.shape[0], SCAN_CHUNK_SIZE):
+        chunk = quantized[start:start + SCAN_CHUNK_SIZE].astype(np.float32)
+        scores[start:start + len(chunk)] = chunk @ query_vector
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def rerank(matrix, query_vector, candidate_ids, k):
+    """
+    Exact scores for the candidates against the full-precision matrix.
+
+    Returns:
+        (row_ids, scores) arrays, best first
+    """
+    candidate_ids = np.sort(candidate_ids)
+    scores = np.asarray(matrix[candidate_ids], dtype=np.float32) @ query_vector
+    order = np.argsort(-scores, kind="stable")[:k]
+    return candidate_ids[order], scores[order]
+
+
+def nbytes(quantized, scales):
+    return quantized.nbytes + (scales.nbytes if scales is not None else 0)
@@ -3,56 +3,128 @@ Elasticsearch Query Builder for Clinical Trials Search.
 Builds targeted queries based on extracted entities.
 """
 
+import json
+import os
+
+from services.cache import LRUCache
+
 # --- Configuration ---
 DEFAULT_PAGE_SIZE = 10
 MAX_PAGE_SIZE = 100
+# Entity-dependent query bodies, reused across pages and repeat searches
+QUERY_TEMPLATE_CACHE_SIZE = int(os.getenv("QUERY_TEMPLATE_CACHE_SIZE", "1024"))
+QUERY_TEMPLATE_CACHE_TTL = int(os.getenv("QUERY_TEMPLATE_CACHE_TTL", "3600"))  # seconds
+# Levels of narrower MeSH descriptors added to a condition (0 = synonyms only)
+CONDITION_DESCENDANT_DEPTH = int(os.getenv("CONDITION_DESCENDANT_DEPTH", "0"))
+MAX_DESCENDANT_TERMS = 30
+# How a condition's MeSH synonyms are combined. Latency and recall have not
+# been measured yet; scripts/benchmark_condition_expansion.py compares them.
+#   fuzzy          one fuzzy match per synonym (default)
+#   terms_keyword  exact synonyms in one terms query on conditions.name.keyword
+#                  plus one fuzzy match on the original condition
+#   match_phrase   one match_phrase per synonym, no fuzziness
+CONDITION_EXPANSION_STRATEGIES = ("fuzzy", "terms_keyword", "match_phrase")
+CONDITION_EXPANSION = os.getenv("CONDITION_EXPANSION", "fuzzy")
 
 
 # --- Helper Functions for Nested Queries ---
 
-def build_condition_query(condition):
-    """Build nested query for conditions.name using MeSH synonyms."""
-    from services.mesh_service import get_synonyms
+def condition_terms(condition, synonyms=None, descendant_depth=0):
+    """
+    Every name a condition is searched under: its MeSH synonyms (looked up
+    unless given) plus descendants down to descendant_depth levels.
+    """
+    if not synonyms:
+        from services.mesh_service import get_synonyms
+        synonyms = get_synonyms(condition)
 
-    synonyms = get_synonyms(condition)
+    if descendant_depth > 0:
+        from services.mesh_service import get_descendants
+        descendants = get_descendants(condition, descendant_depth)[:MAX_DESCENDANT_TERMS]
+        synonyms = list(dict.fromkeys(synonyms + descendants))
+    return synonyms
+
+
+def build_condition_query(condition, synonyms=None, descendant_depth=None, expansion=None):
+    """
+    Build nested query for conditions.name using MeSH synonyms.
+    Pass synonyms already resolved by the NLP service to skip the lookup.
+    With descendant_depth > 0, narrower MeSH descriptors are OR'd in too.
+    expansion picks how synonyms are combined (see CONDITION_EXPANSION).
+    """
+    if descendant_depth is None:
+        descendant_depth = CONDITION_DESCENDANT_DEPTH
+    synonyms = condition_terms(condition, synonyms, descendant_depth)
+
+    expansion = expansion or CONDITION_EXPANSION
+    if expansion not in CONDITION_EXPANSION_STRATEGIES:
+        raise ValueError(f"Unknown condition expansion: {expansion}")
 
     if len(synonyms) == 1:
         # Single term — simple match with fuzziness as safety net
-        return {
-            "nested": {
-                "path": "conditions",
-                "query": {
-                    "match": {
-                        "conditions.name": {
-                            "query": synonyms[0],
-                            "fuzziness": "AUTO"
+        query = {
+            "match": {
+                "conditions.name": {
+                    "query": synonyms[0],
+                    "fuzziness": "AUTO"
+                }
+            }
+        }
+
+    elif expansion == "terms_keyword":
+        # Exact synonyms in one terms lookup, fuzziness only on the original
+        query = {
+            "bool": {
+                "should": [
+                    {"terms": {"conditions.name.keyword": synonyms}},
+                    {
+                        "match": {
+                            "conditions.name": {
+                                "query": condition,
+                                "fuzziness": "AUTO"
+                            }
                         }
                     }
-                }
+                ],
+                "minimum_should_match": 1
             }
         }
 
-    # Multiple synonyms — OR them together
-    should_clauses = []
-    for synonym in synonyms:
-        should_clauses.append({
-            "match": {
-                "conditions.name": {
-                    "query": synonym,
-                    "fuzziness": "AUTO"
+    elif expansion == "match_phrase":
+        # Each synonym must appear as a whole phrase; no fuzzy term expansion
+        query = {
+            "bool": {
+                "should": [
+                    {"match_phrase": {"conditions.name": synonym}}
+                    for synonym in synonyms
+                ],
+                "minimum_should_match": 1
+            }
+        }
+
+    else:
+        # Multiple synonyms — OR them together
+        should_clauses = []
+        for synonym in synonyms:
+            should_clauses.append({
+                "match": {
+                    "conditions.name": {
+                        "query": synonym,
+                        "fuzziness": "AUTO"
+                    }
                 }
+            })
+        query = {
+            "bool": {
+                "should": should_clauses,
+                "minimum_should_match": 1
             }
-        })
+        }
 
     return {
         "nested": {
             "path": "conditions",
-            "query": {
-                "bool": {
-                    "should": should_clauses,
-                    "minimum_should_match": 1
-                }
-            }
+            "query": query
         }
     }
 
@@ -94,19 +166,33 @@ def build_sponsor_query(sponsor):
     }
 
 
-def build_intervention_query(intervention):
-    """Build nested query for interventions.name"""
+def build_intervention_query(intervention, synonyms=None):
+    """
+    Build nested query for interventions.name.
+    MeSH synonyms resolved by the NLP service are OR'd with the term itself.
+    """
+    terms = list(dict.fromkeys([intervention] + (synonyms or [])))
+    should_clauses = [
+        {
+            "match": {
+                "interventions.name": {
+                    "query": term,
+                    "fuzziness": "AUTO"
+                }
+            }
+        }
+        for term in terms
+    ]
+
+    if len(should_clauses) == 1:
+        query = should_clauses[0]
+    else:
+        query = {"bool": {"should": should_clauses, "minimum_should_match": 1}}
+
     return {
         "nested": {
             "path": "interventions",
-            "query": {
-                "match": {
-                    "interventions.name": {
-                        "query": intervention,
-                        "fuzziness": "AUTO"
-                    }
-                }
-            }
+            "query": query
         }
     }
 
@@ -192,25 +278,189 @@ def build_highlight_config():
     }
 
 
+# --- Aggregations ---
+
+def build_terms_agg(field, size=10):
+    """Top values of a top-level keyword field, counted per trial."""
+    return {"terms": {"field": field, "size": size}}
+
+
+def build_nested_terms_agg(path, field, size=10, nested_filter=None):
+    """
+    Top values of a keyword field inside a nested array. reverse_nested
+    counts trials rather than nested entries (a trial with 40 US sites
+    counts once), and buckets are ordered by that trial count.
+    nested_filter restricts which nested entries are counted.
+    """
+    values = {
+        "values": {
+            "terms": {"field": field, "size": size, "order": {"trials": "desc"}},
+            "aggs": {"trials": {"reverse_nested": {}}}
+        }
+    }
+    if nested_filter is not None:
+        values = {"matching": {"filter": nested_filter, "aggs": values}}
+    return {"nested": {"path": path}, "aggs": values}
+
+
+def build_summary_aggs(size=10):
+    """
+    Status, phase, lead sponsor and country breakdowns for question answers.
+    Collaborators are left out, like the sponsor shown on each result.
+    """
+    return {
+        "status": build_terms_agg("overall_status", size),
+        "phase": build_terms_agg("phase", size),
+        "sponsor": build_nested_terms_agg(
+            "sponsors", "sponsors.name.keyword", size,
+            nested_filter={"term": {"sponsors.lead_or_collaborator": "lead"}}
+        ),
+        "country": build_nested_terms_agg("facilities", "facilities.country.keyword", size),
+    }
+
+
+# Facets /api/search can return: name -> (nested path or None, keyword field)
+FACETS = {
+    "status": (None, "overall_status"),
+    "phase": (None, "phase"),
+    "country": ("facilities", "facilities.country.keyword"),
+    "sponsor_class": ("sponsors", "sponsors.agency_class"),
+    "age": ("age", "age.age_category"),
+    "intervention_type": ("interventions", "interventions.intervention_type"),
+}
+FACET_SIZE = 20
+
+
+def build_facet_aggs(names, size=FACET_SIZE):
+    """Aggs for the requested facet names; ValueError for unknown names."""
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValueError(f"Unknown facets: {', '.join(unknown)}")
+
+    aggs = {}
+    for name in names:
+        path, field = FACETS[name]
+        if path is None:
+            aggs[name] = build_terms_agg(field, size)
+        else:
+            aggs[name] = build_nested_terms_agg(path, field, size)
+    return aggs
+
+
+def agg_counts(aggregations, name):
+    """[(value, trial count), ...] from an aggregation built above."""
+    agg = aggregations.get(name, {})
+    agg = agg.get("matching", agg)
+    if "values" in agg:
+        return [(b["key"], b["trials"]["doc_count"]) for b in agg["values"]["buckets"]]
+    return [(b["key"], b["doc_count"]) for b in agg.get("buckets", [])]
+
+
+def build_aggregation_query(entities, aggs):
+    """The entities' bool query with no hits, an exact total and aggs."""
+    parts = dict(_get_template(entities))
+    return {
+        "query": json.loads(parts["query"]),
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": aggs
+    }
+
+
 # --- Main Query Builder ---
 
+_template_cache = LRUCache(QUERY_TEMPLATE_CACHE_SIZE, ttl=QUERY_TEMPLATE_CACHE_TTL)
+PAGE_KEYS = ("from", "size")
+
+
+def _page_window(page, size):
+    """Validated (offset, size) for a page."""
+    page = max(1, page)
+    size = min(max(1, size), MAX_PAGE_SIZE)
+    return (page - 1) * size, size
+
+
+def _expand_conditions(entities):
+    """
+    {condition: condition_terms(...)} for every condition, using the NLP
+    service's synonyms when present. Done on every call (lookups are
+    memoized in mesh_service) so the template key holds what was actually
+    resolved: a lookup that fell back to [condition] after an embedding
+    error gets its own template instead of being reused for the cache TTL.
+    """
+    resolved = entities.get("condition_synonyms", {})
+    return {
+        condition: condition_terms(condition, resolved.get(condition), CONDITION_DESCENDANT_DEPTH)
+        for condition in entities.get("condition", [])
+    }
+
+
+def _get_template(entities):
+    """
+    Cached serialized template for a set of entities, keyed by their
+    canonical JSON and their expanded conditions: a list of (name, JSON)
+    for each top-level value, with None in place of from/size. Only strings
+    are cached, so no caller can alter a cached template.
+    """
+    expanded = _expand_conditions(entities) if entities else {}
+    key = json.dumps([entities, expanded], sort_keys=True, default=str)
+    parts = _template_cache.get(key)
+    if parts is None:
+        template = _build_query_template(entities, expanded)
+        parts = [
+            (name, None if name in PAGE_KEYS else json.dumps(value))
+            for name, value in template.items()
+        ]
+        _template_cache.set(key, parts)
+    return parts
+
+
 def build_query(entities, page=1, size=10):
     """
     Build Elasticsearch DSL query from extracted entities.
     All entity values are arrays (normalized by NLP service).
     Multiple values for the same entity are OR'd together.
+
+    The body is parsed from build_query_json, so every call returns fresh
+    objects that the caller may modify freely.
     """
-    # Validate pagination
-    page = max(1, page)
-    size = min(max(1, size), MAX_PAGE_SIZE)
-    offset = (page - 1) * size
+    return json.loads(build_query_json(entities, page, size))
+
+
+def build_query_json(entities, page=1, size=10, aggs=None):
+    """
+    build_query serialized to JSON, reusing the cached serialization of the
+    entity-dependent parts. Identical searches give identical strings.
+    """
+    offset, size = _page_window(page, size)
+    parts = _get_template(entities)
 
+    window = {"from": offset, "size": size}
+    fields = [
+        f'"{name}": {window[name] if value is None else value}'
+        for name, value in parts
+    ]
+    if aggs:
+        fields.append(f'"aggs": {json.dumps(aggs, sort_keys=True)}')
+    return "{" + ", ".join(fields) + "}"
+
+
+def get_template_cache_stats():
+    """Hit/miss counters for cached query templates."""
+    return _template_cache.stats()
+
+
+def _build_query_template(entities, expanded):
+    """
+    Query body for entities, with from/size left as None. expanded holds the
+    search terms of each condition (see _expand_conditions).
+    """
     # Handle empty entities — return all results
     if not entities:
         return {
             "query": {"match_all": {}},
-            "from": offset,
-            "size": size,
+            "from": None,
+            "size": None,
             "sort": [{"enrollment": "desc"}]
         }
 
@@ -240,12 +490,12 @@ def build_query(entities, page=1, size=10):
         conditions = entities["condition"]
         op = entities.get("condition_op", "OR")
         if len(conditions) == 1:
-            must_clauses.append(build_condition_query(conditions[0]))
+            must_clauses.append(build_condition_query(conditions[0], expanded[conditions[0]], 0))
         elif op == "AND":
             for c in conditions:
-                must_clauses.append(build_condition_query(c))
+                must_clauses.append(build_condition_query(c, expanded[c], 0))
         else:
-            cond_should = [build_condition_query(c) for c in conditions]
+            cond_should = [build_condition_query(c, expanded[c], 0) for c in conditions]
             must_clauses.append({
                 "bool": {"should": cond_should, "minimum_should_match": 1}
             })
@@ -281,13 +531,14 @@ def build_query(entities, page=1, size=10):
     if "intervention" in entities:
         interventions = entities["intervention"]
         op = entities.get("intervention_op", "OR")
+        resolved = entities.get("intervention_synonyms", {})
         if len(interventions) == 1:
-            must_clauses.append(build_intervention_query(interventions[0]))
+            must_clauses.append(build_intervention_query(interventions[0], resolved.get(interventions[0])))
         elif op == "AND":
             for i in interventions:
-                must_clauses.append(build_intervention_query(i))
+                must_clauses.append(build_intervention_query(i, resolved.get(i)))
         else:
-            intv_should = [build_intervention_query(i) for i in interventions]
+            intv_should = [build_intervention_query(i, resolved.get(i)) for i in interventions]
             must_clauses.append({
                 "bool": {"should": intv_should, "minimum_should_match": 1}
             })
@@ -356,8 +607,8 @@ def build_query(entities, page=1, size=10):
 
     query = {
         "query": {"bool": bool_query},
-        "from": offset,
-        "size": size,
+        "from": None,
+        "size": None,
         "sort": [
             {"_score": "desc"},
             {"enrollment": "desc"}
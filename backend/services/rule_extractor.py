@@ -0,0 +1,294 @@
+"""
+Deterministic entity extractor used as a fast path before the LLM.
+
+The known vocabularies (unique_terms.json plus phase, status, country and
+age aliases) are compiled into one Aho-Corasick automaton over word tokens,
+so a single pass over the query finds every known phrase. Conditions are also
+matched against MeSH keys by looking up word n-grams.
+
+The output uses the entity schema of nlp_service.extract_entities. Its
+confidence is the share of query tokens explained by a match or a filler
+word, so anything the rules don't understand (cities, dates, "only", "not")
+sends the query to the LLM.
+"""
+import os
+import re
+import threading
+from collections import deque
+
+# Configuration
+# Minimum confidence to skip the LLM; set above 1 to disable the fast path
+CONFIDENCE_THRESHOLD = float(os.getenv("RULE_EXTRACTOR_THRESHOLD", "1.0"))
+MAX_NGRAM = 6  # longest MeSH key tried for conditions, in words
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+PHASE_ALIASES = {
+    "EARLY_PHASE1": ["early phase 1", "early phase i", "phase 0"],
+    "PHASE1": ["phase 1", "phase i", "phase one"],
+    "PHASE2": ["phase 2", "phase ii", "phase two"],
+    "PHASE3": ["phase 3", "phase iii", "phase three"],
+    "PHASE4": ["phase 4", "phase iv", "phase four"],
+    "PHASE1/PHASE2": ["phase 1/2", "phase i/ii"],
+    "PHASE2/PHASE3": ["phase 2/3", "phase ii/iii"],
+}
+
+# Same wording as SYSTEM_PROMPT; ambiguous words like "open" are left to the LLM
+STATUS_ALIASES = {
+    "RECRUITING": ["recruiting", "enrolling", "active", "accepting patients"],
+    "NOT_YET_RECRUITING": ["not yet recruiting", "not yet open", "upcoming", "planned"],
+    "ACTIVE_NOT_RECRUITING": ["active not recruiting", "active but not recruiting", "ongoing"],
+    "COMPLETED": ["completed", "closed", "finished"],
+    "SUSPENDED": ["suspended", "paused", "on hold"],
+    "TERMINATED": ["terminated", "stopped", "cancelled", "canceled"],
+    "WITHDRAWN": ["withdrawn"],
+}
+
+COUNTRY_ALIASES = {
+    "United States": ["usa", "u.s.", "u.s.a.", "america", "united states of america"],
+    "United Kingdom": ["uk", "u.k.", "britain", "great britain"],
+}
+# Only matched as written: lowercase "us" is usually the pronoun ("show us ...")
+CASE_SENSITIVE_COUNTRY_ALIASES = {"US": "United States"}
+
+AGE_ALIASES = {
+    "adult": ["adult", "adults"],
+    "child": ["child", "children", "pediatric", "paediatric", "kids"],
+    "older-adults": ["older adult", "older adults", "elderly", "seniors"],
+}
+
+SPONSOR_SUFFIXES = re.compile(r",?\s+(inc\.?|lp|llc|ltd\.?|corporation|corp\.?)$", re.IGNORECASE)
+
+# Words that carry no entity; "only", "both", "all", "not" are deliberately absent
+FILLER_WORDS = {
+    "a", "an", "the", "show", "me", "find", "get", "list", "search", "please",
+    "for", "of", "in", "on", "at", "with", "by", "from", "to", "and", "or",
+    "trial", "trials", "study", "studies", "clinical", "research", "patients",
+    "any", "are", "is", "there", "how", "many", "which", "what", "do", "that",
+}
+
+QUESTION_PREFIXES = ("how many", "which", "what", "are there", "is there", "do any")
+QUESTION_PHRASES = ("count", "list all", "tell me about", "compare")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class AhoCorasick:
+    """Multi-pattern matcher over token sequences."""
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # [(pattern length, value)]
+
+    def add(self, tokens, value):
+        """Add a pattern; the first value added for a pattern wins."""
+        node = 0
+        for token in tokens:
+            child = self._goto[node].get(token)
+            if child is None:
+                child = self._goto[node][token] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = child
+        if node and not self._out[node]:
+            self._out[node].append((len(tokens), value))
+
+    def build(self):
+        """Compute failure links breadth-first; call once after all add()s."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter_matches(self, tokens):
+        """Yield (start, end, value) for every pattern occurrence."""
+        node = 0
+        for i, token in enumerate(tokens):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for length, value in self._out[node]:
+                yield i + 1 - length, i + 1, value
+
+
+class RuleExtractor:
+    """
+    Compiled vocabularies for one unique_terms.json.
+
+    condition_matcher is an optional callable(text) -> bool used for the
+    MeSH n-gram lookup (see mesh_service.is_condition_term).
+    """
+
+    def __init__(self, terms, condition_matcher=None):
+        self.condition_matcher = condition_matcher
+        self.matcher = AhoCorasick()
+
+        # Insertion order is the priority when two vocabularies share a phrase
+        for value, aliases in PHASE_ALIASES.items():
+            self._add_all("phase", value, aliases)
+        for value, aliases in STATUS_ALIASES.items():
+            self._add_all("status", value, aliases)
+        for status in terms.get("statuses", []):
+            if status in STATUS_ALIASES:
+                self._add("status", status, status.replace("_", " "))
+        for value, aliases in AGE_ALIASES.items():
+            self._add_all("age_group", value, aliases)
+        for value, aliases in COUNTRY_ALIASES.items():
+            self._add_all("location", value, aliases)
+        # {token tuple: the only spelling that counts}
+        self.case_sensitive = {}
+        for alias, value in CASE_SENSITIVE_COUNTRY_ALIASES.items():
+            self._add("location", value, alias)
+            self.case_sensitive[tuple(tokenize(alias))] = alias
+        self._add_all("location", None, terms.get("countries", []))
+        for sponsor in terms.get("sponsors", []):
+            self._add("sponsor", sponsor, sponsor)
+            self._add("sponsor", sponsor, SPONSOR_SUFFIXES.sub("", sponsor))
+        self._add_all("condition", None, terms.get("conditions", []))
+        self._add_all("intervention", None, terms.get("interventions", []))
+
+        self.matcher.build()
+
+    def _add(self, entity, value, phrase):
+        tokens = tokenize(phrase)
+        # Phrases made only of filler words or numbers would match everywhere
+        if all(t in FILLER_WORDS or t.isdigit() for t in tokens):
+            return
+        self.matcher.add(tokens, (entity, value))
+
+    def _add_all(self, entity, value, phrases):
+        for phrase in phrases:
+            self._add(entity, value if value is not None else phrase, phrase)
+
+    def extract(self, query):
+        """
+        Returns:
+            {"entities": {...}, "confidence": float}; entity values are lists
+        """
+        lowered = query.lower()
+        spans = [m.span() for m in TOKEN_RE.finditer(lowered)]
+        tokens = [lowered[start:end] for start, end in spans]
+        if not tokens:
+            return {"entities": {}, "confidence": 0.0}
+
+        # Offsets in lowered are only valid in query if lowering kept the length
+        source = query if len(query) == len(lowered) else lowered
+
+        # (start, end, priority, entity, value)
+        candidates = []
+        for start, end, (entity, value) in self.matcher.iter_matches(tokens):
+            required = self.case_sensitive.get(tuple(tokens[start:end]))
+            if required is not None and source[spans[start][0]:spans[end - 1][1]] != required:
+                continue
+            if entity == "sponsor":
+                # As mentioned, like the LLM: a full name such as "Genentech, Inc."
+                # would also match every sponsor named "... Inc."
+                value = source[spans[start][0]:spans[end - 1][1]]
+            candidates.append((start, end, 0, entity, value))
+        if self.condition_matcher is not None:
+            for start in range(len(tokens)):
+                for end in range(start + 1, min(len(tokens), start + MAX_NGRAM) + 1):
+                    if all(t in FILLER_WORDS for t in tokens[start:end]):
+                        continue
+                    text = source[spans[start][0]:spans[end - 1][1]]
+                    if self.condition_matcher(text):
+                        candidates.append((start, end, 1, "condition", text))
+
+        # Longest match first; overlapping shorter matches are dropped
+        candidates.sort(key=lambda c: (c[0] - c[1], c[0], c[2]))
+        covered = [t in FILLER_WORDS for t in tokens]
+        taken = [False] * len(tokens)
+        chosen = []
+        for start, end, _, entity, value in candidates:
+            if any(taken[start:end]):
+                continue
+            for i in range(start, end):
+                taken[i] = covered[i] = True
+            chosen.append((start, entity, value))
+
+        entities = {}
+        for _, entity, value in sorted(chosen):
+            values = entities.setdefault(entity, [])
+            if value not in values:
+                values.append(value)
+        if not entities:
+            return {"entities": {}, "confidence": 0.0}
+
+        normalized = " ".join(tokens)
+        is_question = normalized.startswith(QUESTION_PREFIXES) or any(
+            f" {phrase} " in f" {normalized} " for phrase in QUESTION_PHRASES
+        )
+        entities["query_type"] = "question" if is_question else "search"
+
+        return {"entities": entities, "confidence": sum(covered) / len(tokens)}
+
+
+# Global state
+_extractor = None
+_extractor_lock = threading.Lock()
+_stats = {"attempts": 0, "hits": 0}
+_stats_lock = threading.Lock()
+
+
+def get_extractor():
+    """Build the extractor on first use from unique_terms.json and the MeSH keys."""
+    global _extractor
+
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                from services.embedding_service import load_unique_terms
+
+                condition_matcher = None
+                try:
+                    from services.mesh_service import is_condition_term
+                    is_condition_term("")  # loads the MeSH cache now, not mid-request
+                    condition_matcher = is_condition_term
+                except Exception as e:
+                    print(f"Rule extractor running without MeSH keys: {e}")
+
+                _extractor = RuleExtractor(load_unique_terms(), condition_matcher)
+    return _extractor
+
+
+def fast_path_extract(query):
+    """
+    Entities for query if the rules are confident enough, else None.
+    """
+    if CONFIDENCE_THRESHOLD > 1:
+        return None
+
+    try:
+        result = get_extractor().extract(query)
+    except Exception as e:
+        print(f"Rule extractor failed: {e}")
+        return None
+
+    confident = result["confidence"] >= CONFIDENCE_THRESHOLD
+    with _stats_lock:
+        _stats["attempts"] += 1
+        if confident:
+            _stats["hits"] += 1
+    return result["entities"] if confident else None
+
+
+def get_rule_extractor_stats():
+    """How often the fast path answered without the LLM."""
+    with _stats_lock:
+        attempts, hits = _stats["attempts"], _stats["hits"]
+    return {
+        "attempts": attempts,
+        "hits": hits,
+        "hit_rate": hits / attempts if attempts else 0.0,
+        "threshold": CONFIDENCE_THRESHOLD,
+    }
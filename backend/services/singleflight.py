@@ -0,0 +1,86 @@
+"""
+Request coalescing: concurrent calls with the same key share one execution.
+
+The first caller for a key (the leader) runs the function; callers that
+arrive while it is in flight wait for it and get the same result, or the
+same exception. Nothing is cached once the call finishes.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _Call:
+    def __init__(self):
+        self.future = Future()  # waitable from threads and from any event loop
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicate concurrent identical calls. Shared results must be treated as read-only."""
+
+    def __init__(self, name=""):
+        self.name = name
+        self._calls = {}  # {key: _Call}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """Return (call, leader) for key, registering a new call if none is in flight."""
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.executions += 1
+            return call, True
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call for key is already in flight."""
+        call, leader = self._join(key)
+        if not leader:
+            return call.future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Like do(), for a coroutine function; waiting doesn't block the event loop."""
+        call, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(call.future)
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+        self._finish(key, call, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
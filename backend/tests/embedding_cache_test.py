@@ -0,0 +1,152 @@
+# Tests for the on-disk embeddings cache in services/embedding_service.py
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from services import embedding_service
+
+DIMENSION = 16
+
+
+def random_index(rng, n):
+    terms = [f"term {i}" for i in range(n)]
+    vectors = rng.standard_normal((n, DIMENSION)).astype(np.float32)
+    return embedding_service.build_term_index(dict(zip(terms, vectors)))
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    path = str(tmp_path / "embeddings_cache")
+    monkeypatch.setattr(embedding_service, "CACHE_DIR", path)
+    return path
+
+
+def test_float16_cache_is_rewritten_as_float32(cache_dir):
+    rng = np.random.default_rng(0)
+    term_index = {"conditions": random_index(rng, 50), "interventions": random_index(rng, 20)}
+    embedding_service.save_embeddings_cache(term_index)
+
+    # A cache written when EMBEDDINGS_CACHE_DTYPE=float16 was still an option
+    version_dir = embedding_service.current_cache_dir()
+    meta_path = os.path.join(version_dir, embedding_service.CACHE_META_FILE)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta["dtype"] = "float16"
+    for category, index in term_index.items():
+        np.save(os.path.join(version_dir, f"{category}.npy"), index["matrix"].astype(np.float16))
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+    loaded = embedding_service.load_embeddings_cache()
+    for category, index in term_index.items():
+        assert loaded[category]["matrix"].dtype == np.float32
+        assert np.allclose(loaded[category]["matrix"], index["matrix"], atol=1e-3)
+        assert list(loaded[category]["terms"]) == list(index["terms"])
+    assert embedding_service.current_cache_dir() != version_dir
+    with open(os.path.join(embedding_service.current_cache_dir(), embedding_service.CACHE_META_FILE)) as f:
+        assert json.load(f)["dtype"] == "float32"
+
+
+def test_quantized_copy_is_saved_and_memory_mapped(cache_dir, monkeypatch):
+    rng = np.random.default_rng(1)
+    monkeypatch.setattr(embedding_service, "QUANTIZATION", "int8")
+    embedding_service.save_embeddings_cache({"conditions": random_index(rng, 300)})
+    version_dir = embedding_service.current_cache_dir()
+    assert os.path.exists(os.path.join(version_dir, "conditions_int8.npy"))
+    assert os.path.exists(os.path.join(version_dir, "conditions_int8_scales.npy"))
+
+    exact = embedding_service.load_embeddings_cache()
+    for mode in ("int8", "float16"):  # float16 was not saved and is written on demand
+        term_index = embedding_service.load_embeddings_cache()
+        embedding_service.quantize_term_index(term_index, mode)
+        assert isinstance(term_index["conditions"]["quantized"], np.memmap)
+        assert os.path.exists(os.path.join(version_dir, f"conditions_{mode}.npy"))
+
+        queries = rng.standard_normal((10, DIMENSION)).astype(np.float32)
+        for query in queries:
+            monkeypatch.setattr(embedding_service, "_term_index", exact)
+            expected = embedding_service.search_term_index(query, "conditions", k=3)
+            monkeypatch.setattr(embedding_service, "_term_index", term_index)
+            found = embedding_service.search_term_index(query, "conditions", k=3)
+            assert [t for t, _ in found] == [t for t, _ in expected]
+            assert np.allclose([s for _, s in found], [s for _, s in expected], atol=1e-5)
+
+
+def terms_of(term_index):
+    return {category: list(index["terms"]) for category, index in term_index.items()}
+
+
+def test_readers_see_a_complete_version_during_a_rewrite(cache_dir, monkeypatch):
+    rng = np.random.default_rng(2)
+    old = {"conditions": random_index(rng, 40)}
+    new = {"conditions": random_index(rng, 60)}
+    embedding_service.save_embeddings_cache(old)
+
+    # Just before the pointer switch the new version is fully written, but
+    # readers still get the old one
+    write_aside = embedding_service._write_aside
+    seen = []
+
+    def check_then_write(path, write):
+        seen.append(terms_of(embedding_service.load_embeddings_cache()))
+        write_aside(path, write)
+
+    monkeypatch.setattr(embedding_service, "_write_aside", check_then_write)
+    embedding_service.save_embeddings_cache(new)
+
+    assert seen == [terms_of(old)]
+    assert terms_of(embedding_service.load_embeddings_cache()) == terms_of(new)
+
+
+def test_concurrent_writers_leave_one_complete_version(cache_dir):
+    rng = np.random.default_rng(3)
+    versions = [{"conditions": random_index(rng, 30 + i)} for i in range(4)]
+    errors = []
+
+    def save(term_index):
+        try:
+            embedding_service.save_embeddings_cache(term_index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(v,)) for v in versions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+
+    assert errors == []
+    assert terms_of(embedding_service.load_embeddings_cache()) in [terms_of(v) for v in versions]
+    assert not [name for name in os.listdir(cache_dir) if name.startswith("tmp-") or ".tmp" in name]
+
+
+def test_unversioned_cache_is_read_then_replaced(cache_dir):
+    rng = np.random.default_rng(4)
+    old = {"conditions": random_index(rng, 25)}
+    embedding_service.save_embeddings_cache(old)
+
+    # The layout before versioning: files directly in CACHE_DIR, no pointer
+    version_dir = embedding_service.current_cache_dir()
+    for name in os.listdir(version_dir):
+        os.rename(os.path.join(version_dir, name), os.path.join(cache_dir, name))
+    os.rmdir(version_dir)
+    os.remove(os.path.join(cache_dir, embedding_service.CACHE_POINTER_FILE))
+
+    assert embedding_service.current_cache_dir() == cache_dir
+    assert terms_of(embedding_service.load_embeddings_cache()) == terms_of(old)
+
+    new = {"conditions": random_index(rng, 35)}
+    embedding_service.save_embeddings_cache(new)
+    assert terms_of(embedding_service.load_embeddings_cache()) == terms_of(new)
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        [
+            embedding_service.CACHE_LOCK_FILE,
+            embedding_service.CACHE_POINTER_FILE,
+            os.path.basename(embedding_service.current_cache_dir()),
+        ]
+    )
@@ -0,0 +1,69 @@
+# Tests for checkpointed batch embedding against scripts/fake_embeddings_server.py
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from openai import OpenAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+import fake_embeddings_server
+from services import embedding_service
+
+TERMS = [f"term {i}" for i in range(23)]
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    monkeypatch.setattr(fake_embeddings_server, "LATENCY", 0.0)
+    server = ThreadingHTTPServer(("localhost", 0), fake_embeddings_server.EmbeddingsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    base_url = f"http://localhost:{server.server_address[1]}/v1"
+    monkeypatch.setattr(embedding_service, "client", OpenAI(base_url=base_url, api_key="fake"))
+    monkeypatch.setattr(embedding_service, "EMBED_BATCH_SIZE", 5)
+    monkeypatch.setattr(embedding_service, "EMBED_MAX_IN_FLIGHT", 1)
+    monkeypatch.setattr(embedding_service, "EMBED_MAX_RETRIES", 0)
+    yield
+    server.shutdown()
+
+
+def test_resume_after_crash_and_torn_line(fake_server, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    embed_batch = embedding_service.embed_batch
+    sent = []
+
+    def crash_on_third_batch(batch):
+        sent.append(batch)
+        if len(sent) == 3:
+            raise RuntimeError("crash")
+        return embed_batch(batch)
+
+    monkeypatch.setattr(embedding_service, "embed_batch", crash_on_third_batch)
+    with pytest.raises(RuntimeError):
+        embedding_service.compute_all_embeddings(TERMS, checkpoint)
+
+    # A crash in the middle of a write leaves a fragment without a newline
+    with open(checkpoint, "a") as f:
+        f.write('{"terms": ["term 10", "te')
+    done = set(embedding_service.load_checkpoint(checkpoint))
+    assert len(done) == 18  # 5 batches of up to 5, the third one failed
+
+    sent.clear()
+    embeddings = embedding_service.compute_all_embeddings(TERMS, checkpoint)
+    assert [t for batch in sent for t in batch] == [t for t in TERMS if t not in done]
+    assert list(embeddings) == TERMS
+    for term in TERMS:
+        assert np.allclose(embeddings[term], fake_embeddings_server.fake_embedding(term), atol=1e-6)
+
+    # The checkpoint is intact, so a later resume embeds nothing
+    with open(checkpoint) as f:
+        assert all(json.loads(line) for line in f)
+    sent.clear()
+    assert embedding_service.compute_all_embeddings(TERMS, checkpoint) == embeddings
+    assert sent == []
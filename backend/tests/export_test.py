@@ -0,0 +1,119 @@
+# Tests for the streaming export in app/routes/export.py
+import csv
+import io
+import json
+import os
+
+import pytest
+from flask import Flask
+
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from app.routes import export
+
+DOCS = [{"nct_id": f"NCT{i:03d}", "brief_title": f"Trial {i}"} for i in range(7)]
+ENTITIES = {"status": ["RECRUITING"], "query_type": "search"}
+
+
+class FakeES:
+    """Serves DOCS in pages of export.EXPORT_PAGE_SIZE, optionally failing on one page."""
+
+    def __init__(self, fail_on_page=None):
+        self.fail_on_page = fail_on_page
+        self.pages = 0
+        self.open_pits = set()
+
+    def open_point_in_time(self, index, keep_alive):
+        self.open_pits.add("pit")
+        return {"id": "pit"}
+
+    def close_point_in_time(self, id):
+        self.open_pits.discard(id)
+
+    def search(self, body):
+        self.pages += 1
+        if self.pages == self.fail_on_page:
+            raise ConnectionError("node went away")
+        start = int(body.get("search_after", [-1])[0]) + 1
+        hits = [
+            {"_source": doc, "_score": 1.0, "sort": [start + i]}
+            for i, doc in enumerate(DOCS[start:start + body["size"]])
+        ]
+        return {"pit_id": "pit", "hits": {"hits": hits}}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_PAGE_SIZE", 3)
+    monkeypatch.setattr(export, "extract_entities", lambda q: {"success": True, "entities": ENTITIES})
+    app = Flask(__name__)
+    app.register_blueprint(export.export_bp, url_prefix="/api")
+    return app.test_client()
+
+
+def use_es(monkeypatch, es):
+    monkeypatch.setattr(export, "get_es_client", lambda: es)
+    return es
+
+
+def test_ndjson_streams_every_hit(client, monkeypatch):
+    es = use_es(monkeypatch, FakeES())
+    lines = client.get("/api/export/anything").data.decode().splitlines()
+
+    assert [json.loads(line)["nct_id"] for line in lines] == [d["nct_id"] for d in DOCS]
+    assert es.open_pits == set()
+
+
+def test_csv_failure_before_first_hit_keeps_header(client, monkeypatch):
+    es = use_es(monkeypatch, FakeES(fail_on_page=1))
+    rows = list(csv.reader(io.StringIO(client.get("/api/export/anything?format=csv").data.decode())))
+
+    assert rows == [export.CSV_COLUMNS, ["ERROR", "node went away"]]
+    assert es.open_pits == set()
+
+
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+def test_failure_mid_stream_ends_with_error_record(client, monkeypatch, export_format):
+    es = use_es(monkeypatch, FakeES(fail_on_page=2))
+    body = client.get(f"/api/export/anything?format={export_format}").data.decode()
+
+    if export_format == "ndjson":
+        records = [json.loads(line) for line in body.splitlines()]
+        assert [r["nct_id"] for r in records[:-1]] == [d["nct_id"] for d in DOCS[:3]]
+        assert records[-1] == {"success": False, "error": "node went away"}
+    else:
+        rows = list(csv.reader(io.StringIO(body)))
+        assert rows[0] == export.CSV_COLUMNS
+        assert [r[0] for r in rows[1:-1]] == [d["nct_id"] for d in DOCS[:3]]
+        assert rows[-1] == ["ERROR", "node went away"]
+    assert es.open_pits == set()
+
+
+def test_point_in_time_closed_when_client_stops_reading(client, monkeypatch):
+    es = use_es(monkeypatch, FakeES())
+    # Keep the generators alive so only an explicit close can release the PIT
+    streams = []
+    iter_hits = export.iter_hits
+    monkeypatch.setattr(export, "iter_hits", lambda *a: streams.append(iter_hits(*a)) or streams[-1])
+
+    response = client.get("/api/export/anything", buffered=False)
+    stream = iter(response.response)
+    next(stream)
+    assert es.open_pits == {"pit"}
+
+    response.close()
+    assert es.open_pits == set()
+
+
+@pytest.mark.parametrize("entities", [
+    {"query_type": "search"},
+    {"query_type": "search", "condition": [], "date": {}},
+])
+def test_query_without_filters_is_rejected(client, monkeypatch, entities):
+    es = use_es(monkeypatch, FakeES())
+    monkeypatch.setattr(export, "extract_entities", lambda q: {"success": True, "entities": entities})
+    response = client.get("/api/export/all trials")
+
+    assert response.status_code == 400
+    assert response.json["success"] is False
+    assert es.pages == 0 and es.open_pits == set()
@@ -0,0 +1,59 @@
+# Tests for services/fuzzy_index.py against difflib.get_close_matches
+import difflib
+import random
+
+from services.fuzzy_index import FuzzyIndex
+
+# Common bucketed characters, shared-bucket ASCII and non-ASCII characters
+ALPHABET = "abcdefghijklmnopqrstuvwxyz" * 3 + "0123 -,()'" + "#%*=?" + "éöçßαβ漢"
+
+
+def random_key(rng):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 30)))
+
+
+def mutate(rng, key):
+    """A near miss: a few random edits, or an unrelated string."""
+    if rng.random() < 0.2:
+        return random_key(rng)
+    chars = list(key)
+    for _ in range(rng.randint(0, 4)):
+        op = rng.random()
+        position = rng.randrange(len(chars) + 1)
+        if op < 0.4 or not chars:
+            chars.insert(position, rng.choice(ALPHABET))
+        elif op < 0.7:
+            del chars[min(position, len(chars) - 1)]
+        else:
+            chars[min(position, len(chars) - 1)] = rng.choice(ALPHABET)
+    return "".join(chars) or "a"
+
+
+def expected_match(word, keys, cutoff):
+    matches = difflib.get_close_matches(word, keys, n=1, cutoff=cutoff)
+    if not matches:
+        return None, 0.0
+    return matches[0], difflib.SequenceMatcher(None, matches[0], word).ratio()
+
+
+def test_matches_difflib_on_random_keys():
+    rng = random.Random(0)
+    keys = list({random_key(rng) for _ in range(3000)})
+    # Anagrams tie on the length and histogram bounds
+    keys += ["".join(rng.sample(key, len(key))) for key in keys[:200]]
+    keys = list(dict.fromkeys(keys))
+    index = FuzzyIndex(keys)
+
+    for cutoff in (0.6, 0.8, 0.95):
+        for _ in range(150):
+            word = mutate(rng, rng.choice(keys))
+            assert index.get_close_match(word, cutoff) == expected_match(word, keys, cutoff), word
+
+
+def test_long_words_fall_back_to_difflib():
+    rng = random.Random(1)
+    keys = ["a" * 300 + "b", "a" * 299, random_key(rng)]
+    index = FuzzyIndex(keys)
+
+    word = "a" * 298 + "b"
+    assert index.get_close_match(word, 0.6) == expected_match(word, keys, 0.6)
@@ -0,0 +1,38 @@
+# Tests for scripts/build_mesh_cache.py against a small MeSH fixture
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import build_mesh_cache
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "desc_sample.xml")
+
+
+def build(tmp_path, name, **kwargs):
+    synonyms_path = tmp_path / f"{name}_synonyms.json"
+    terms_path = tmp_path / f"{name}_terms.json"
+    tree_path = tmp_path / f"{name}_tree.json"
+    build_mesh_cache.build_mesh_cache(
+        FIXTURE, str(synonyms_path), str(terms_path), str(tree_path), **kwargs
+    )
+    return synonyms_path.read_bytes(), terms_path.read_bytes(), tree_path.read_bytes()
+
+
+def test_parallel_parser_matches_elementtree(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_mesh_cache, "RECORDS_PER_CHUNK", 7)
+
+    reference = build(tmp_path, "reference", reference=True)
+    assert build(tmp_path, "serial", workers=1) == reference
+    assert build(tmp_path, "parallel", workers=2) == reference
+
+
+def test_permuted_terms_are_skipped():
+    records = list(build_mesh_cache.iter_records_parallel(FIXTURE, workers=1))
+    names = [name for name, _, _ in records]
+    terms = {name: record_terms for name, record_terms, _ in records}
+
+    assert names[0] == "Neoplasms"
+    assert "Neoplasms, Lung" not in terms["Lung Neoplasms"]
+    assert terms["Empty Terms"] == []
+    assert "Sjögren's Syndrome" in terms["Sjögren's Syndrome"]
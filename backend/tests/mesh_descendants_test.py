@@ -0,0 +1,113 @@
+# Tests for get_descendants in services/mesh_service.py against a full scan
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+import build_mesh_cache
+from services import mesh_service
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "desc_sample.xml")
+DEPTHS = [None, 0, 1, 2, 3]
+
+
+def expected_descendants(tree, term, depth):
+    """Every tree number is checked against every prefix of the term."""
+    descriptor = tree["names"].index(term)
+    prefixes = [
+        tn for tn, d in zip(tree["tree_numbers"], tree["descriptor_ids"]) if d == descriptor
+    ]
+    seen = {descriptor}
+    names = []
+    for prefix in prefixes:
+        for tn, d in zip(tree["tree_numbers"], tree["descriptor_ids"]):
+            if not tn.startswith(prefix + "."):
+                continue
+            if depth is not None and tn.count(".") - prefix.count(".") > depth:
+                continue
+            if d not in seen and tree["names"][d]:
+                seen.add(d)
+                names.append(tree["names"][d])
+    return names
+
+
+def load(monkeypatch, synonyms_path, tree_path):
+    monkeypatch.setattr(mesh_service, "SYNONYMS_FILE", str(synonyms_path))
+    monkeypatch.setattr(mesh_service, "TREE_FILE", str(tree_path))
+    mesh_service.init_mesh_service()
+    with open(tree_path) as f:
+        return json.load(f)
+
+
+def random_tree(rng, n_descriptors=300):
+    """
+    Tree numbers with mixed segment lengths (C01.1 next to C01.10 and C01.1A),
+    gaps, descriptors at several positions, and some without a preferred name.
+    """
+    tree_numbers = []
+    frontier = [f"C{i:02d}" for i in range(1, 5)]
+    while frontier and len(tree_numbers) < n_descriptors * 2:
+        node = frontier.pop(rng.randrange(len(frontier)))
+        tree_numbers.append(node)
+        if node.count(".") < 6:
+            for _ in range(rng.randint(0, 4)):
+                segment = rng.choice(["1", "10", "1A", "2", "100", "05", "9"]) + str(rng.randint(0, 9))
+                frontier.append(f"{node}.{segment}")
+    # Drop some inner numbers: descendants can sit several levels below the
+    # nearest number that is present, as in a MeSH subset like the fixture
+    tree_numbers = sorted(tn for tn in set(tree_numbers) if "." not in tn or rng.random() > 0.1)
+
+    names = [f"Descriptor {i}" if rng.random() > 0.05 else "" for i in range(n_descriptors)]
+    names[0] = "Descriptor 0"
+    descriptor_ids = [rng.randrange(n_descriptors) for _ in tree_numbers]
+    return {
+        "descriptor_count": n_descriptors,
+        "tree_numbers": tree_numbers,
+        "descriptor_ids": descriptor_ids,
+        "names": names,
+    }
+
+
+@pytest.fixture(autouse=True)
+def restore_mesh_service():
+    yield
+    mesh_service._key_groups = None
+    mesh_service._tree_numbers = None
+
+
+def test_fixture_descendants_match_full_scan(monkeypatch, tmp_path):
+    paths = [tmp_path / name for name in ("synonyms.json", "terms.json", "tree.json")]
+    build_mesh_cache.build_mesh_cache(FIXTURE, *map(str, paths))
+    tree = load(monkeypatch, paths[0], paths[2])
+
+    assert mesh_service.get_descendants("Lung Neoplasms", 1)
+    for term in filter(None, tree["names"]):
+        for depth in DEPTHS:
+            assert mesh_service.get_descendants(term, depth) == expected_descendants(tree, term, depth), (term, depth)
+
+
+def test_random_tree_descendants_match_full_scan(monkeypatch, tmp_path):
+    rng = random.Random(0)
+    tree = random_tree(rng)
+    synonyms = {
+        "format": 2,
+        "groups": [[name or f"unnamed {i}"] for i, name in enumerate(tree["names"])],
+        "keys": {name.lower(): i for i, name in enumerate(tree["names"]) if name},
+    }
+    synonyms_path, tree_path = tmp_path / "synonyms.json", tmp_path / "tree.json"
+    synonyms_path.write_text(json.dumps(synonyms))
+    tree_path.write_text(json.dumps(tree))
+    load(monkeypatch, synonyms_path, tree_path)
+
+    checked = 0
+    for term in rng.sample([name for name in tree["names"] if name], 120):
+        for depth in DEPTHS + [6]:
+            expected = expected_descendants(tree, term, depth)
+            assert mesh_service.get_descendants(term, depth) == expected, (term, depth)
+            checked += bool(expected)
+    assert checked > 100
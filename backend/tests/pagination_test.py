@@ -0,0 +1,83 @@
+# Tests for services/pagination.py
+import base64
+import json
+
+import pytest
+
+from services.pagination import (
+    TIEBREAKER_SORT, CursorError, build_cursor_body, decode_cursor, encode_cursor, next_cursor
+)
+from services.query_builder import MAX_PAGE_SIZE
+
+QUERY = "lung cancer trials in Boston"
+
+
+def forged_token(**changes):
+    """A token with the right fingerprint whose fields were edited by the client."""
+    token = encode_cursor("pit-1", [1.5, 20, "NCT001"], 2, 10, QUERY)
+    state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    state.update(changes)
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip("=")
+
+
+def response(n_hits, total, relation="eq"):
+    hits = [{"_id": str(i), "sort": [1.0, i, f"NCT{i:03d}"]} for i in range(n_hits)]
+    return {"pit_id": "pit-2", "hits": {"hits": hits, "total": {"value": total, "relation": relation}}}
+
+
+def test_round_trip():
+    token = encode_cursor("pit-1", [1.5, 20, "NCT001"], 3, 25, QUERY)
+    assert "=" not in token
+    assert decode_cursor(token, QUERY) == {
+        "pit": "pit-1", "after": [1.5, 20, "NCT001"], "page": 3, "size": 25
+    }
+
+
+MISSING_FIELDS = base64.urlsafe_b64encode(b'{"pit": "pit-1"}').decode()
+
+
+@pytest.mark.parametrize("token", ["", "not base64!", "bm90IGpzb24", MISSING_FIELDS])
+def test_malformed_tokens(token):
+    with pytest.raises(CursorError):
+        decode_cursor(token, QUERY)
+
+
+def test_token_for_another_query():
+    with pytest.raises(CursorError, match="another query|this query"):
+        decode_cursor(encode_cursor("pit-1", [1], 2, 10, QUERY), "other query")
+
+
+@pytest.mark.parametrize("changes", [
+    {"page": "x"}, {"page": 0}, {"page": -1}, {"page": 2.5}, {"page": True},
+    {"size": "10"}, {"size": 0}, {"size": MAX_PAGE_SIZE + 1}, {"size": None},
+    {"pit": 7}, {"after": "NCT001"},
+])
+def test_forged_fields_are_rejected(changes):
+    with pytest.raises(CursorError):
+        decode_cursor(forged_token(**changes), QUERY)
+
+
+def test_size_limit_is_accepted():
+    assert decode_cursor(forged_token(size=MAX_PAGE_SIZE), QUERY)["size"] == MAX_PAGE_SIZE
+
+
+def test_next_cursor():
+    # A full page with more results left points at the next page
+    token = next_cursor(response(10, 35), 2, 10, QUERY)
+    assert decode_cursor(token, QUERY) == {
+        "pit": "pit-2", "after": [1.0, 9, "NCT009"], "page": 3, "size": 10
+    }
+    # Short page, or a full page that reaches an exact total: last page
+    assert next_cursor(response(5, 35), 4, 10, QUERY) is None
+    assert next_cursor(response(10, 30), 3, 10, QUERY) is None
+    # A lower-bound total does not end pagination
+    assert next_cursor(response(10, 30, "gte"), 3, 10, QUERY) is not None
+
+
+def test_build_cursor_body():
+    body = build_cursor_body({"query": {}, "from": 20, "sort": [{"_score": "desc"}]}, "pit-1", [1.0, "NCT001"])
+    assert "from" not in body
+    assert body["sort"] == [{"_score": "desc"}, TIEBREAKER_SORT]
+    assert body["pit"]["id"] == "pit-1"
+    assert body["search_after"] == [1.0, "NCT001"]
+    assert "search_after" not in build_cursor_body({"sort": []}, "pit-1")
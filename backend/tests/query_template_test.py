@@ -0,0 +1,78 @@
+# Tests for the cached query templates in services/query_builder.py
+import copy
+import json
+
+import pytest
+
+from services import mesh_service, query_builder
+from services.query_builder import build_query, build_query_json
+
+SYNONYMS = {
+    "lung cancer": ["Lung Neoplasms", "Lung Cancer", "Pulmonary Neoplasms"],
+    "diabetes": ["Diabetes Mellitus", "Diabetes"],
+}
+
+ENTITY_SHAPES = [
+    {},
+    {"phase": ["PHASE3"], "status": ["RECRUITING"], "query_type": "search"},
+    {"condition": ["lung cancer"]},
+    {"condition": ["lung cancer", "unknown thing"], "condition_op": "AND"},
+    {
+        "condition": ["lung cancer", "diabetes"],
+        "condition_synonyms": {"diabetes": ["Diabetes Mellitus", "Diabetes"]},
+        "intervention": ["Chemotherapy", "Placebo"],
+        "intervention_synonyms": {"Chemotherapy": ["Drug Therapy", "Chemotherapy"]},
+        "location": ["United States", "Italy"],
+        "location_op": "AND",
+        "sponsor": ["Pfizer", "Novartis"],
+        "age_group": ["adult", "child"],
+        "keyword": ["EGFR"],
+        "date": {"start": "2020-01-01", "end": "2023-12-31"},
+        "phase": ["PHASE1", "PHASE2"],
+        "status": ["COMPLETED", "TERMINATED"],
+        "query_type": "question",
+    },
+]
+
+
+@pytest.fixture(autouse=True)
+def fake_synonyms(monkeypatch):
+    """MeSH lookups without the MeSH cache; each test starts with an empty template cache."""
+    monkeypatch.setattr(mesh_service, "get_synonyms", lambda term: SYNONYMS.get(term.lower(), [term]))
+    query_builder._template_cache.clear()
+
+
+@pytest.mark.parametrize("entities", ENTITY_SHAPES)
+def test_json_matches_build_query(entities):
+    for page, size in [(1, 10), (2, 10), (7, 25), (0, 0), (3, 500)]:
+        body = build_query_json(entities, page, size)
+        assert body == json.dumps(build_query(entities, page, size))
+        assert json.loads(body)["from"] == (max(1, page) - 1) * min(max(1, size), 100)
+
+
+def test_callers_cannot_corrupt_cached_template():
+    entities = ENTITY_SHAPES[-1]
+    expected = copy.deepcopy(build_query(entities, 2, 10))
+    expected_json = build_query_json(entities, 2, 10)
+
+    query = build_query(entities, 2, 10)
+    query["query"]["bool"]["must"].append({"match_all": {}})
+    query["query"]["bool"]["must"][0]["bool"]["should"][1]["nested"]["path"] = "changed"
+    query["sort"].append({"nct_id": "asc"})
+    query["highlight"].clear()
+    query.pop("from")
+
+    assert build_query(entities, 2, 10) == expected
+    assert build_query_json(entities, 2, 10) == expected_json
+
+
+def test_degraded_synonyms_are_not_reused(monkeypatch):
+    entities = {"condition": ["lung cancer"]}
+
+    # Embedding fallback failed: only the term itself
+    monkeypatch.setattr(mesh_service, "get_synonyms", lambda term: [term])
+    assert "Lung Neoplasms" not in build_query_json(entities)
+
+    # The next lookup succeeds and gets a template of its own
+    monkeypatch.setattr(mesh_service, "get_synonyms", lambda term: SYNONYMS[term])
+    assert "Lung Neoplasms" in build_query_json(entities)
@@ -0,0 +1,112 @@
+# Tests for services/rule_extractor.py with a small hand-made vocabulary
+import json
+import os
+import re
+
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from services.nlp_service import SYSTEM_PROMPT, _normalize_entities
+from services.rule_extractor import AhoCorasick, RuleExtractor
+
+TERMS = {
+    "conditions": ["Lung Cancer", "Breast Cancer"],
+    "interventions": ["Placebo"],
+    "sponsors": ["Pfizer", "Genentech, Inc."],
+    "countries": ["Italy", "United States"],
+    "phases": ["PHASE3"],
+    "statuses": ["RECRUITING", "ACTIVE_NOT_RECRUITING", "UNKNOWN"],
+}
+
+
+def test_automaton_finds_overlapping_patterns():
+    matcher = AhoCorasick()
+    for phrase in ["lung", "lung cancer", "cancer trials", "small cell lung cancer"]:
+        matcher.add(phrase.split(), phrase)
+    matcher.build()
+
+    matches = set(matcher.iter_matches("non small cell lung cancer trials".split()))
+    assert matches == {
+        (3, 4, "lung"),
+        (3, 5, "lung cancer"),
+        (1, 5, "small cell lung cancer"),
+        (4, 6, "cancer trials"),
+    }
+
+
+def test_simple_query_is_fully_explained():
+    extractor = RuleExtractor(TERMS, condition_matcher=lambda text: text.lower() == "nsclc")
+
+    result = extractor.extract("Phase 3 recruiting NSCLC and breast cancer trials in the USA")
+    assert result["confidence"] == 1.0
+    assert result["entities"] == {
+        "phase": ["PHASE3"],
+        "status": ["RECRUITING"],
+        "condition": ["NSCLC", "Breast Cancer"],
+        "location": ["United States"],
+        "query_type": "search",
+    }
+
+    result = extractor.extract("how many active but not recruiting Genentech trials?")
+    assert result["entities"]["status"] == ["ACTIVE_NOT_RECRUITING"]
+    assert result["entities"]["sponsor"] == ["Genentech"]
+    assert result["entities"]["query_type"] == "question"
+
+
+def test_unknown_words_lower_confidence():
+    extractor = RuleExtractor(TERMS)
+
+    assert extractor.extract("Pfizer trials in Boston")["confidence"] < 1.0
+    assert extractor.extract("lung cancer trials in Italy only")["confidence"] < 1.0
+    assert extractor.extract("show me clinical trials")["confidence"] == 0.0
+
+
+# Vocabulary covering the terms in SYSTEM_PROMPT's examples
+PROMPT_TERMS = {
+    "conditions": ["Lung Cancer", "Breast Cancer", "Diabetes", "Melanoma", "Hypertension"],
+    "interventions": ["Chemotherapy", "Radiotherapy", "Immunotherapy"],
+    "sponsors": ["Pfizer Inc.", "Novartis"],
+    "countries": ["United States", "United Kingdom", "Italy"],
+    "statuses": ["RECRUITING", "COMPLETED", "TERMINATED"],
+}
+# Free-text values: the fast path returns the vocabulary's casing, the LLM the query's
+CASE_INSENSITIVE = {"condition", "intervention", "sponsor"}
+
+
+def comparable(entities):
+    return {
+        key: [v.casefold() for v in values] if key in CASE_INSENSITIVE else values
+        for key, values in entities.items()
+    }
+
+
+def test_fast_path_agrees_with_prompt_examples():
+    """Every SYSTEM_PROMPT example the rules are confident about gets the LLM's answer."""
+    extractor = RuleExtractor(PROMPT_TERMS)
+    examples = re.findall(r'Query: "(.*)"\nOutput: (.*)', SYSTEM_PROMPT)
+
+    checked = 0
+    for query, output in examples:
+        result = extractor.extract(query)
+        if result["confidence"] < 1.0:
+            continue
+        expected = json.loads(output)
+        _normalize_entities(expected)
+        assert comparable(result["entities"]) == comparable(expected), query
+        checked += 1
+    assert checked >= 10
+
+
+def test_ambiguous_country_and_sponsor_words():
+    extractor = RuleExtractor(PROMPT_TERMS)
+
+    # Capital "US" is the country; lowercase "us" is left to the LLM
+    result = extractor.extract("Pfizer or Novartis diabetes studies in US and UK")
+    assert result["confidence"] == 1.0
+    assert result["entities"]["location"] == ["United States", "United Kingdom"]
+    result = extractor.extract("show us lung cancer trials")
+    assert result["confidence"] < 1.0
+    assert "location" not in result["entities"]
+
+    # Sponsors come back as written, not as the vocabulary's legal name
+    assert extractor.extract("Pfizer trials")["entities"]["sponsor"] == ["Pfizer"]
+    assert extractor.extract("pfizer inc trials")["entities"]["sponsor"] == ["pfizer inc"]
@@ -0,0 +1,154 @@
+# Tests for services/singleflight.py
+import asyncio
+import threading
+
+import pytest
+
+from services.singleflight import SingleFlight
+
+CALLERS = 5
+
+
+class CountingFlight(SingleFlight):
+    """SingleFlight that sets all_joined once CALLERS calls have registered."""
+
+    def __init__(self):
+        super().__init__()
+        self.all_joined = threading.Event()
+        self._joined = 0
+        self._joined_lock = threading.Lock()
+
+    def _join(self, key):
+        joined = super()._join(key)
+        with self._joined_lock:
+            self._joined += 1
+            if self._joined == CALLERS:
+                self.all_joined.set()
+        return joined
+
+
+def run_callers(flight, fn, outcomes):
+    """Start CALLERS threads calling flight.do("key", fn) together."""
+    start = threading.Barrier(CALLERS)
+
+    def caller():
+        start.wait(5)
+        try:
+            outcomes.append(("ok", flight.do("key", fn)))
+        except Exception as e:
+            outcomes.append(("error", e))
+
+    threads = [threading.Thread(target=caller) for _ in range(CALLERS)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = CountingFlight()
+    release = threading.Event()
+    executions = []
+
+    def slow():
+        executions.append(len(executions) + 1)
+        assert release.wait(5)
+        return {"value": len(executions)}
+
+    outcomes = []
+    threads = run_callers(flight, slow, outcomes)
+    assert flight.all_joined.wait(5)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert executions == [1]
+    assert len(outcomes) == CALLERS
+    assert all(kind == "ok" and result is outcomes[0][1] for kind, result in outcomes)
+    assert flight.stats() == {"calls": CALLERS, "executions": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+    # Finished calls are not cached
+    flight.do("key", slow)
+    assert executions == [1, 2]
+
+
+def test_errors_reach_every_waiter():
+    flight = CountingFlight()
+    release = threading.Event()
+
+    def fail():
+        assert release.wait(5)
+        raise ValueError("boom")
+
+    outcomes = []
+    threads = run_callers(flight, fail, outcomes)
+    assert flight.all_joined.wait(5)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(outcomes) == CALLERS
+    assert all(kind == "error" and isinstance(e, ValueError) for kind, e in outcomes)
+    assert flight.stats() == {"calls": CALLERS, "executions": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+    # The failed call is not cached either
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+
+
+async def run_async_callers(flight, fn):
+    """CALLERS tasks calling flight.do_async("key", fn) on this loop; fn runs once all have joined."""
+    release = asyncio.Event()
+
+    async def release_when_joined():
+        assert await asyncio.to_thread(flight.all_joined.wait, 5)
+        release.set()
+
+    async def gated():
+        await release.wait()
+        return await fn()
+
+    releaser = asyncio.create_task(release_when_joined())
+    outcomes = await asyncio.gather(
+        *(flight.do_async("key", gated) for _ in range(CALLERS)), return_exceptions=True
+    )
+    await releaser
+    return outcomes
+
+
+def test_async_calls_share_one_execution():
+    flight = CountingFlight()
+    executions = []
+
+    async def search():
+        executions.append(len(executions) + 1)
+        await asyncio.sleep(0)
+        return {"value": len(executions)}
+
+    outcomes = asyncio.run(run_async_callers(flight, search))
+
+    assert executions == [1]
+    assert all(result is outcomes[0] for result in outcomes)
+    assert outcomes[0] == {"value": 1}
+    assert flight.stats() == {"calls": CALLERS, "executions": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+    # Finished calls are not cached
+    asyncio.run(flight.do_async("key", search))
+    assert executions == [1, 2]
+
+
+def test_async_errors_reach_every_waiter():
+    flight = CountingFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    outcomes = asyncio.run(run_async_callers(flight, fail))
+
+    assert len(outcomes) == CALLERS
+    assert all(isinstance(e, ValueError) for e in outcomes)
+    assert flight.stats() == {"calls": CALLERS, "executions": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+    # The failed call is not cached either
+    with pytest.raises(ValueError):
+        asyncio.run(flight.do_async("key", fail))